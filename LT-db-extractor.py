@@ -1,15 +1,13 @@
 #!/usr/bin/env python
 
-import psycopg2
-import psycopg2.extras
 import argparse
 import json
 import os
 import zipfile
-import paramiko
 import numpy as np
 import cv2
 from tqdm import tqdm
+from dsf.data import lemnatec
 
 
 def options():
@@ -17,6 +15,8 @@ def options():
                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument("-c", "--config", help="JSON config file.", required=True)
     parser.add_argument("-o", "--outdir", help="Output directory for results.", required=True)
+    parser.add_argument("--fetch-size", help="Number of rows fetched from the database server at a time.", type=int,
+                        default=1000)
     args = parser.parse_args()
 
     if os.path.exists(args.outdir):
@@ -30,15 +30,15 @@ def main():
     args = options()
 
     # Read the database connetion configuration file
-    config = open(args.config, 'rU')
-    # Load the JSON configuration data
-    db = json.load(config)
+    with open(args.config, 'r') as fp:
+        # Load the JSON configuration data
+        db = json.load(fp)
+    config = lemnatec.config.Config(username=db['username'], password=db['password'], hostname=db['hostname'],
+                                    dataformat={}, metadata={}, timezone="", database=db['database'],
+                                    experiment=db['experiment'])
 
     # SSH connection
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    ssh.connect(db['hostname'], username='root', password=db['password'])
-    sftp = ssh.open_sftp()
+    sftp = lemnatec.open_sftp_connection(config=config)
 
     # Make the output directory
     os.mkdir(args.outdir)
@@ -47,29 +47,7 @@ def main():
     csv = open(os.path.join(args.outdir, "SnapshotInfo.csv"), "w")
 
     # Connect to the LemnaTec database
-    conn = psycopg2.connect(host=db['hostname'], user=db['username'], password=db['password'], database=db['database'])
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-
-    # Get all snapshots
-    snapshots = {}
-    cur.execute("SELECT * FROM snapshot WHERE measurement_label = %s;", [db['experiment']])
-    for row in cur:
-        snapshots[row['id']] = row
-
-    # Get all image metadata
-    images = {}
-    raw_images = {}
-    cur.execute("SELECT * FROM snapshot INNER JOIN tiled_image ON snapshot.id = tiled_image.snapshot_id INNER JOIN "
-                "tile ON tiled_image.id = tile.tiled_image_id")
-    for row in cur:
-        if row['snapshot_id'] in snapshots:
-            image_name = row['camera_label'] + '_' + str(row['tiled_image_id']) + '_' + str(row['frame'])
-            if row['snapshot_id'] in images:
-                images[row['snapshot_id']].append(image_name)
-            else:
-                images[row['snapshot_id']] = [image_name]
-            raw_images[image_name] = {'raw_image_oid': row['raw_image_oid'],
-                                      'rotate_flip_type': row['rotate_flip_type'], 'dataformat': row['dataformat']}
+    cur = lemnatec.open_database_connection(config=config)
 
     # Create SnapshotInfo.csv file
     header = ['experiment', 'id', 'plant barcode', 'car tag', 'timestamp', 'weight before', 'weight after',
@@ -77,105 +55,45 @@ def main():
     csv.write(','.join(map(str, header)) + '\n')
 
     # Stats
-    total_snapshots = len(snapshots)
+    total_snapshots = 0
     total_water_jobs = 0
     total_images = 0
 
-    for snapshot_id in tqdm(snapshots.keys()):
-        # Reformat the completed field
-        # if snapshots[snapshot_id]['completed'] == 't':
-        #     snapshots[snapshot_id]['completed'] = 'true'
-        # else:
-        #     snapshots[snapshot_id]['completed'] = 'false'
+    # Stream the experiment snapshots and their image tiles, filtered by measurement label on the database server
+    for snapshot, tiles in tqdm(lemnatec.iter_experiment(db=cur, experiment=db['experiment'],
+                                                         fetch_size=args.fetch_size)):
+        total_snapshots += 1
+        snapshot_id = snapshot['id']
 
         # Group all the output metadata
-        snapshot = snapshots[snapshot_id]
         values = [db['experiment'], snapshot['id'], snapshot['id_tag'], snapshot['car_tag'],
                   snapshot['time_stamp'].strftime('%Y-%m-%d %H:%M:%S'), snapshot['weight_before'],
                   snapshot['weight_after'], snapshot['water_amount'], snapshot['completed'],
-                  snapshot['measurement_label'], '']
+                  db['experiment'], '']
 
         # If the snapshot also contains images, add them to the output
-        if snapshot_id in images:
-            values.append(';'.join(map(str, images[snapshot_id])))
-            total_images += len(images[snapshot_id])
+        if tiles:
+            images = [tile['camera_label'] + '_' + str(tile['tiled_image_id']) + '_' + str(tile['frame'])
+                      for tile in tiles]
+            values.append(';'.join(images))
+            total_images += len(images)
             # Create the local directory
             snapshot_dir = os.path.join(args.outdir, "snapshot" + str(snapshot_id))
             os.mkdir(snapshot_dir)
 
-            for image in images[snapshot_id]:
+            for image, tile in zip(images, tiles):
                 # Copy the raw image to the local directory
                 remote_dir = os.path.join("/data/pgftp", db['database'],
                                           snapshot['time_stamp'].strftime("%Y-%m-%d"),
-                                          "blob" + str(raw_images[image]['raw_image_oid']))
-                local_file = os.path.join(snapshot_dir, "blob" + str(raw_images[image]['raw_image_oid']))
+                                          "blob" + str(tile['raw_image_oid']))
+                local_file = os.path.join(snapshot_dir, "blob" + str(tile['raw_image_oid']))
                 try:
                     sftp.get(remote_dir, local_file)
                 except IOError as e:
                     print("I/O error({0}): {1}. Offending file: {2}".format(e.errno, e.strerror, remote_dir))
 
                 if os.path.exists(local_file):
-                    # Is the file a zip file?
-                    if zipfile.is_zipfile(local_file):
-                        zf = zipfile.ZipFile(local_file)
-                        zff = zf.open("data")
-                        img_str = zff.read()
-
-                        if 'VIS' in image or 'vis' in image:
-                            if len(img_str) == db['vis_height'] * db['vis_width']:
-                                raw = np.fromstring(img_str, dtype=np.uint8, count=db['vis_height']*db['vis_width'])
-                                raw_img = raw.reshape((db['vis_height'], db['vis_width']))
-                                img = cv2.cvtColor(raw_img, cv2.COLOR_BAYER_RG2BGR)
-                                if raw_images[image]['rotate_flip_type'] != 0:
-                                    img = rotate_image(img)
-                                cv2.imwrite(os.path.join(snapshot_dir, image + ".png"), img)
-                                os.remove(local_file)
-                            else:
-                                print("Warning: File {0} containing image {1} seems corrupted.".format(local_file,
-                                                                                                       image))
-                        elif 'NIR' in image or 'nir' in image:
-                            raw_rescale = None
-                            if raw_images[image]['dataformat'] == 4:
-                                # New NIR camera data format (16-bit)
-                                if len(img_str) == (db['nir_height'] * db['nir_width']) * 2:
-                                    raw = np.fromstring(img_str, dtype=np.uint16,
-                                                        count=db['nir_height'] * db['nir_width'])
-                                    if np.max(raw) > 4096:
-                                        print("Warning: max value for image {0} is greater than 4096.".format(image))
-                                    raw_rescale = np.multiply(raw, 16)
-                                else:
-                                    print("Warning: File {0} containing image {1} seems corrupted.".format(local_file,
-                                                                                                           image))
-                            elif raw_images[image]['dataformat'] == 0:
-                                # Old NIR camera data format (8-bit)
-                                if len(img_str) == (db['nir_height'] * db['nir_width']):
-                                    raw_rescale = np.fromstring(img_str, dtype=np.uint8,
-                                                                count=db['nir_height'] * db['nir_width'])
-                                else:
-                                    print("Warning: File {0} containing image {1} seems corrupted.".format(local_file,
-                                                                                                           image))
-                            if raw_rescale is not None:
-                                raw_img = raw_rescale.reshape((db['nir_height'], db['nir_width']))
-                                if raw_images[image]['rotate_flip_type'] != 0:
-                                    raw_img = rotate_image(raw_img)
-                                cv2.imwrite(os.path.join(snapshot_dir, image + ".png"), raw_img)
-                                os.remove(local_file)
-                        else:
-                            raw = np.fromstring(img_str, dtype=np.uint16, count=db['psII_height'] * db['psII_width'])
-                            if np.max(raw) > 16384:
-                                print("Warning: max value for image {0} is greater than 16384.".format(image))
-                            raw_rescale = np.multiply(raw, 4)
-                            raw_img = raw_rescale.reshape((db['psII_height'], db['psII_width']))
-                            if raw_images[image]['rotate_flip_type'] != 0:
-                                raw_img = rotate_image(raw_img)
-                            cv2.imwrite(os.path.join(snapshot_dir, image + ".png"), raw_img)
-                            os.remove(local_file)
-                        zff.close()
-                        zf.close()
-                        # os.remove(local_file)
-                    else:
-                        print("Warning: the local file {0} containing image {1} is not a proper zip file.".format(
-                            local_file, image))
+                    convert_image(db=db, local_file=local_file, image=image, tile=tile, snapshot_dir=snapshot_dir)
                 else:
                     print("Warning: the local file {0} containing image {1} was not copied correctly.".format(
                         local_file, image))
@@ -185,16 +103,81 @@ def main():
 
         csv.write(','.join(map(str, values)) + '\n')
 
+    csv.close()
     cur.close()
-    conn.close()
-    sftp.close()
-    ssh.close()
+    cur.connection.close()
+    lemnatec.close_sftp_connection(sftp=sftp)
 
     print("Total snapshots = " + str(total_snapshots))
     print("Total water jobs = " + str(total_water_jobs))
     print("Total images = " + str(total_images))
 
 
+def convert_image(db, local_file, image, tile, snapshot_dir):
+    """Convert a raw image blob to a PNG file
+
+    :param db: dict
+    :param local_file: str
+    :param image: str
+    :param tile: dict
+    :param snapshot_dir: str
+    """
+    # Is the file a zip file?
+    if not zipfile.is_zipfile(local_file):
+        print("Warning: the local file {0} containing image {1} is not a proper zip file.".format(local_file, image))
+        return
+    zf = zipfile.ZipFile(local_file)
+    zff = zf.open("data")
+    img_str = zff.read()
+    zff.close()
+    zf.close()
+
+    if 'VIS' in image or 'vis' in image:
+        if len(img_str) == db['vis_height'] * db['vis_width']:
+            raw = np.frombuffer(img_str, dtype=np.uint8, count=db['vis_height'] * db['vis_width'])
+            raw_img = raw.reshape((db['vis_height'], db['vis_width']))
+            img = cv2.cvtColor(raw_img, cv2.COLOR_BAYER_RG2BGR)
+            if tile['rotate_flip_type'] != 0:
+                img = rotate_image(img)
+            cv2.imwrite(os.path.join(snapshot_dir, image + ".png"), img)
+            os.remove(local_file)
+        else:
+            print("Warning: File {0} containing image {1} seems corrupted.".format(local_file, image))
+    elif 'NIR' in image or 'nir' in image:
+        raw_rescale = None
+        if tile['dataformat'] == 4:
+            # New NIR camera data format (16-bit)
+            if len(img_str) == (db['nir_height'] * db['nir_width']) * 2:
+                raw = np.frombuffer(img_str, dtype=np.uint16, count=db['nir_height'] * db['nir_width'])
+                if np.max(raw) > 4096:
+                    print("Warning: max value for image {0} is greater than 4096.".format(image))
+                raw_rescale = np.multiply(raw, 16)
+            else:
+                print("Warning: File {0} containing image {1} seems corrupted.".format(local_file, image))
+        elif tile['dataformat'] == 0:
+            # Old NIR camera data format (8-bit)
+            if len(img_str) == (db['nir_height'] * db['nir_width']):
+                raw_rescale = np.frombuffer(img_str, dtype=np.uint8, count=db['nir_height'] * db['nir_width'])
+            else:
+                print("Warning: File {0} containing image {1} seems corrupted.".format(local_file, image))
+        if raw_rescale is not None:
+            raw_img = raw_rescale.reshape((db['nir_height'], db['nir_width']))
+            if tile['rotate_flip_type'] != 0:
+                raw_img = rotate_image(raw_img)
+            cv2.imwrite(os.path.join(snapshot_dir, image + ".png"), raw_img)
+            os.remove(local_file)
+    else:
+        raw = np.frombuffer(img_str, dtype=np.uint16, count=db['psII_height'] * db['psII_width'])
+        if np.max(raw) > 16384:
+            print("Warning: max value for image {0} is greater than 16384.".format(image))
+        raw_rescale = np.multiply(raw, 4)
+        raw_img = raw_rescale.reshape((db['psII_height'], db['psII_width']))
+        if tile['rotate_flip_type'] != 0:
+            raw_img = rotate_image(raw_img)
+        cv2.imwrite(os.path.join(snapshot_dir, image + ".png"), raw_img)
+        os.remove(local_file)
+
+
 def rotate_image(img):
     """Rotate an image 180 degrees
 
@@ -1,13 +1,44 @@
 from dsf.data.lemnatec.config import load_config
 from dsf.data.lemnatec.connections import open_sftp_connection
 from dsf.data.lemnatec.connections import open_database_connection
+from dsf.data.lemnatec.connections import close_sftp_connection
+from dsf.data.lemnatec.connections import ConnectionPool
 from dsf.data.lemnatec.dataset import init_dataset
 from dsf.data.lemnatec.dataset import load_dataset
 from dsf.data.lemnatec.dataset import save_dataset
+from dsf.data.lemnatec.dataset import scan_dataset
+from dsf.data.lemnatec.dataset import merge_records
+from dsf.data.lemnatec.dataset import get_watermark
+from dsf.data.lemnatec.dataset import update_watermark
+from dsf.data.lemnatec.dataset import iter_records
+from dsf.data.lemnatec.dataset import open_dataset
+from dsf.data.lemnatec.summary import dataset_summary
+from dsf.data.lemnatec.dataset import get_serializer
+from dsf.data.lemnatec.records import ImageRecord
+from dsf.data.lemnatec.records import compact_images
+from dsf.data.lemnatec.records import expand_images
+from dsf.data.lemnatec.store import is_sharded
+from dsf.data.lemnatec.store import load_manifest
+from dsf.data.lemnatec.store import read_records
+from dsf.data.lemnatec.sqlite import is_sqlite
+from dsf.data.lemnatec.sqlite import select_images
+from dsf.data.lemnatec.sqlite import select_snapshots
+from dsf.data.lemnatec.sqlite import sqlite_summary
 from dsf.data.lemnatec.database import query_snapshots
 from dsf.data.lemnatec.database import query_images
+from dsf.data.lemnatec.database import fetch_snapshots
+from dsf.data.lemnatec.database import fetch_images
+from dsf.data.lemnatec.database import fetch_experiment
+from dsf.data.lemnatec.database import iter_experiment
+from dsf.data.lemnatec.database import list_experiments
 from dsf.data.lemnatec.transfers import transfer_images
+from dsf.data.lemnatec.export import export_parquet
 
 
-__all__ = ["load_config", "open_sftp_connection", "open_database_connection", "init_dataset", "load_dataset",
-           "save_dataset", "query_snapshots", "query_images", "transfer_images"]
+__all__ = ["load_config", "open_sftp_connection", "open_database_connection", "close_sftp_connection", "ConnectionPool",
+           "init_dataset", "load_dataset", "save_dataset", "scan_dataset", "merge_records", "get_watermark",
+           "update_watermark", "iter_records", "open_dataset", "dataset_summary", "get_serializer", "ImageRecord",
+           "compact_images", "expand_images", "is_sharded", "load_manifest", "read_records", "is_sqlite",
+           "select_images", "select_snapshots", "sqlite_summary", "query_snapshots", "query_images", "fetch_snapshots",
+           "fetch_images", "fetch_experiment", "iter_experiment", "list_experiments", "transfer_images",
+           "export_parquet"]
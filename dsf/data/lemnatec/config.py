@@ -1,5 +1,6 @@
 import json
 from dataclasses import dataclass
+from dataclasses import field
 
 
 @dataclass
@@ -13,6 +14,10 @@ class Config:
     timezone: str
     database: str = ""
     experiment: str = ""
+    extra_columns: dict = field(default_factory=dict)
+    # Compiled metadata patterns and parsed camera labels, built on first use
+    camera_patterns: dict = field(default=None, init=False, repr=False, compare=False)
+    camera_labels: dict = field(default_factory=dict, init=False, repr=False, compare=False)
 
 
 def load_config(filename: str, database: str, experiment: str) -> Config:
@@ -37,5 +42,6 @@ def load_config(filename: str, database: str, experiment: str) -> Config:
                         metadata=settings["metadata"],
                         timezone=settings["timezone"],
                         database=database,
-                        experiment=experiment)
+                        experiment=experiment,
+                        extra_columns=settings.get("extra_columns", {}))
         return config
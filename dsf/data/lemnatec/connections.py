@@ -1,3 +1,4 @@
+import threading
 import paramiko
 import psycopg
 from psycopg.rows import dict_row
@@ -46,3 +47,138 @@ def open_database_connection(config):
     db = conn.cursor(row_factory=dict_row)
 
     return db
+
+
+def close_sftp_connection(sftp):
+    """Close an SFTP connection and its underlying SSH transport.
+
+    Keyword arguments:
+    sftp = paramiko SFTP connection object.
+
+    :param sftp: paramiko.sftp_client.SFTPClient
+    """
+    transport = sftp.get_channel().get_transport()
+    sftp.close()
+    transport.close()
+
+
+def sftp_alive(sftp):
+    """Check whether the SFTP channel and its SSH transport are still open.
+
+    Keyword arguments:
+    sftp = paramiko SFTP connection object.
+
+    Returns:
+    alive = True if the connection can be used.
+
+    :param sftp: paramiko.sftp_client.SFTPClient
+    :return alive: bool
+    """
+    channel = sftp.get_channel()
+    return channel is not None and not channel.closed and channel.get_transport().is_active()
+
+
+class ConnectionPool:
+    """Pool of reusable database and SFTP connections shared by several downloads.
+
+    Keyword arguments:
+    config = Instance of the class Config.
+    size = Maximum number of idle connections of each kind kept open for reuse (default = 4).
+
+    :param config: dsf.data.lemnatec.config.Config
+    :param size: int
+    """
+    def __init__(self, config, size=4):
+        self.config = config
+        self.size = size
+        self._lock = threading.Lock()
+        self._idle_sftp = []
+        self._idle_db = []
+
+    def acquire_sftp(self):
+        """Get an open SFTP connection, reusing an idle one when possible.
+
+        Returns:
+        sftp = paramiko SFTP connection object.
+
+        :return sftp: paramiko.sftp_client.SFTPClient
+        """
+        while True:
+            with self._lock:
+                if not self._idle_sftp:
+                    break
+                sftp = self._idle_sftp.pop()
+            if sftp_alive(sftp=sftp):
+                return sftp
+            _close_quietly(sftp=sftp)
+        return open_sftp_connection(config=self.config)
+
+    def release_sftp(self, sftp):
+        """Return an SFTP connection to the pool.
+
+        Keyword arguments:
+        sftp = paramiko SFTP connection object.
+
+        :param sftp: paramiko.sftp_client.SFTPClient
+        """
+        with self._lock:
+            if len(self._idle_sftp) < self.size and sftp_alive(sftp=sftp):
+                self._idle_sftp.append(sftp)
+                return
+        _close_quietly(sftp=sftp)
+
+    def acquire_database(self):
+        """Get an open database connection cursor, reusing an idle one when possible.
+
+        Returns:
+        db = Database connection cursor.
+
+        :return db: psycopg.Cursor
+        """
+        while True:
+            with self._lock:
+                if not self._idle_db:
+                    break
+                db = self._idle_db.pop()
+            if not db.connection.closed:
+                return db
+        return open_database_connection(config=self.config)
+
+    def release_database(self, db):
+        """Return a database connection cursor to the pool.
+
+        Keyword arguments:
+        db = Database connection cursor.
+
+        :param db: psycopg.Cursor
+        """
+        # End the transaction so the connection does not hold snapshots open while idle
+        if not db.connection.closed:
+            try:
+                db.connection.rollback()
+            except psycopg.Error:
+                # Connections that failed (e.g. after a dropped query) are closed instead of reused
+                db.connection.close()
+        with self._lock:
+            if len(self._idle_db) < self.size and not db.connection.closed:
+                self._idle_db.append(db)
+                return
+        db.connection.close()
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle_sftp, self._idle_sftp = self._idle_sftp, []
+            idle_db, self._idle_db = self._idle_db, []
+        for sftp in idle_sftp:
+            _close_quietly(sftp=sftp)
+        for db in idle_db:
+            db.connection.close()
+
+
+def _close_quietly(sftp):
+    """Close an SFTP connection, ignoring errors from connections that already dropped."""
+    try:
+        close_sftp_connection(sftp=sftp)
+    except (OSError, EOFError, paramiko.SSHException):
+        pass
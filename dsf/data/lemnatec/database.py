@@ -1,10 +1,28 @@
 import os
 from copy import deepcopy
 import re
+import itertools
 from zoneinfo import ZoneInfo
+from psycopg import sql
+from psycopg.rows import dict_row
+from dsf.data.lemnatec.dataset import merge_records
 
+# Server-side cursor name counter
+_cursor_ids = itertools.count()
 
-def query_snapshots(db, metadata, experiment, config):
+# Snapshot table columns used by the environment records
+SNAPSHOT_COLUMNS = ["id", "id_tag", "car_tag", "time_stamp", "weight_before", "weight_after", "water_amount",
+                    "completed"]
+# Snapshot, tiled_image and tile table columns used by the image records
+IMAGE_COLUMNS = ["snapshot_id", "id_tag", "car_tag", "time_stamp", "camera_label", "tiled_image_id", "frame",
+                 "raw_image_oid", "rotate_flip_type", "dataformat", "width", "height"]
+# Columns used by both record types, for the single pass query
+EXPERIMENT_COLUMNS = ["snapshot.id", "id_tag", "car_tag", "time_stamp", "weight_before", "weight_after", "water_amount",
+                      "completed", "camera_label", "tiled_image_id", "frame", "raw_image_oid", "rotate_flip_type",
+                      "dataformat", "width", "height"]
+
+
+def query_snapshots(db, metadata, experiment, config, fetch_size=None, since=None, bulk=False):
     """Query the database to retrieve all snapshot records.
 
     Keyword arguments:
@@ -12,6 +30,11 @@ def query_snapshots(db, metadata, experiment, config):
     metadata = Dataset metadata.
     experiment = Experiment/Measurement label.
     config = Instance of the class Config.
+    fetch_size = Stream rows from a server-side cursor, fetching this many rows at a time (default = None, fetch all
+                 rows at once).
+    since = Only retrieve snapshots with an ID greater than this watermark, and the snapshots that were incomplete
+            when they were synced (default = None, all snapshots).
+    bulk = Stream rows with a binary COPY instead of a cursor, for large initial syncs (default = False).
 
     Returns:
     meta = Updated dataset metadata
@@ -20,102 +43,520 @@ def query_snapshots(db, metadata, experiment, config):
     :param metadata: dict
     :param experiment: str
     :param config: dsf.data.lemnatec.config.Config
+    :param fetch_size: int
+    :param since: int
+    :param bulk: bool
     :return meta: dict
     """
     # Make a deep copy of the input dictionary
     meta = deepcopy(metadata)
+    environment = fetch_snapshots(db=db, metadata=metadata, experiment=experiment, config=config,
+                                  fetch_size=fetch_size, since=since, bulk=bulk)
+    merge_records(metadata=meta, environment=environment)
+    return meta
+
+
+def query_images(db, metadata, experiment, config, fetch_size=None, since=None, bulk=False):
+    """Query the database to retrieve all image records.
+
+    Keyword arguments:
+    db = Database cursor object.
+    metadata = Dataset metadata.
+    experiment = Experiment/Measurement label.
+    config = Instance of the class Config.
+    fetch_size = Stream rows from a server-side cursor, fetching this many rows at a time (default = None, fetch all
+                 rows at once).
+    since = Only retrieve snapshots with an ID greater than this watermark, and the snapshots that were incomplete
+            when they were synced (default = None, all snapshots).
+    bulk = Stream rows with a binary COPY instead of a cursor, for large initial syncs (default = False).
+
+    Returns:
+    meta = Updated dataset metadata
+
+    :param db: psycopg2.extras.DictCursor
+    :param metadata: dict
+    :param experiment: str
+    :param config: dsf.data.lemnatec.config.Config
+    :param fetch_size: int
+    :param since: int
+    :param bulk: bool
+    :return meta: dict
+    """
+    # Make a deep copy of the input dictionary
+    meta = deepcopy(metadata)
+    images = fetch_images(db=db, metadata=metadata, experiment=experiment, config=config, fetch_size=fetch_size,
+                          since=since, bulk=bulk)
+    merge_records(metadata=meta, images=images)
+    return meta
+
+
+def fetch_snapshots(db, metadata, experiment, config, fetch_size=None, since=None, bulk=False):
+    """Query the database to retrieve the snapshot records that are not in the dataset metadata or were incomplete.
+
+    Keyword arguments:
+    db = Database cursor object.
+    metadata = Dataset metadata.
+    experiment = Experiment/Measurement label.
+    config = Instance of the class Config.
+    fetch_size = Stream rows from a server-side cursor, fetching this many rows at a time (default = None, fetch all
+                 rows at once).
+    since = Only retrieve snapshots with an ID greater than this watermark, and the snapshots that were incomplete
+            when they were synced (default = None, all snapshots).
+    bulk = Stream rows with a binary COPY instead of a cursor, for large initial syncs (default = False).
+
+    Returns:
+    environment = New and updated environment (snapshot) records.
+
+    :param db: psycopg2.extras.DictCursor
+    :param metadata: dict
+    :param experiment: str
+    :param config: dsf.data.lemnatec.config.Config
+    :param fetch_size: int
+    :param since: int
+    :param bulk: bool
+    :return environment: dict
+    """
+    environment = {}
 
     # Get local and UTC timezones
     utc_tz = ZoneInfo("UTC")
 
+    # Extra snapshot table columns to add to the records
+    extra_columns = config.extra_columns.get("snapshot", [])
+
     # Query the database to retrieve all snapshot records for the given experiment
-    db.execute("SELECT * FROM snapshot WHERE measurement_label = %s;", [experiment])
-    for row in db:
+    query = sql.SQL("SELECT {} FROM snapshot WHERE measurement_label = %s").format(
+        _select_columns(columns=SNAPSHOT_COLUMNS, extra_columns=extra_columns))
+    condition, params = _snapshot_filter(column="id", since=since, refresh=_incomplete_snapshots(metadata=metadata))
+    query += condition
+    params = [experiment] + params
+    for row in _execute(db=db, query=query, params=params, fetch_size=fetch_size, bulk=bulk):
         snapshot = f"snapshot{row['id']}"
-        # If the snapshot has not been recorded in the dataset metadata add an empty record
-        if snapshot not in metadata["environment"]:
-            # Set local timezone
-            timestamp = row["time_stamp"]
-            # Convert from local time to UTC
-            utc = timestamp.astimezone(utc_tz)
-            meta["environment"][snapshot] = {
-                "barcode": row["id_tag"],
-                "cartag": row["car_tag"],
-                "timestamp": utc.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
-                "local_time": timestamp.strftime("%Y-%m-%dT%H:%M:%S.%f%z"),
-                "weight_before": row["weight_before"],
-                "weight_after": row["weight_after"],
-                "water_amount": row["water_amount"],
-                "completed": row["completed"]
-            }
+        # Add the snapshots that have not been recorded in the dataset metadata or were incomplete
+        if _needs_update(metadata=metadata, snapshot=snapshot):
+            times = _format_timestamps(timestamp=row["time_stamp"], utc_tz=utc_tz)
+            record = _environment_record(row=row, times=times, extra_columns=extra_columns)
+            if record != metadata["environment"].get(snapshot):
+                environment[snapshot] = record
 
-    return meta
+    return environment
 
 
-def query_images(db, metadata, experiment, config):
-    """Query the database to retrieve all image records.
+def fetch_images(db, metadata, experiment, config, fetch_size=None, since=None, bulk=False):
+    """Query the database to retrieve the image records that are not in the dataset metadata.
 
     Keyword arguments:
     db = Database cursor object.
     metadata = Dataset metadata.
     experiment = Experiment/Measurement label.
     config = Instance of the class Config.
+    fetch_size = Stream rows from a server-side cursor, fetching this many rows at a time (default = None, fetch all
+                 rows at once).
+    since = Only retrieve snapshots with an ID greater than this watermark, and the snapshots that were incomplete
+            when they were synced (default = None, all snapshots).
+    bulk = Stream rows with a binary COPY instead of a cursor, for large initial syncs (default = False).
 
     Returns:
-    meta = Updated dataset metadata
+    images = New image records.
 
     :param db: psycopg2.extras.DictCursor
     :param metadata: dict
     :param experiment: str
     :param config: dsf.data.lemnatec.config.Config
-    :return meta: dict
+    :param fetch_size: int
+    :param since: int
+    :param bulk: bool
+    :return images: dict
     """
-    # Make a deep copy of the input dictionary
-    meta = deepcopy(metadata)
+    images = {}
 
     # Create a UTC timezone
     utc_tz = ZoneInfo("UTC")
 
+    # Extra snapshot, tiled_image and tile table columns to add to the records
+    extra_columns = config.extra_columns.get("image", [])
+
     # Query the database to retrieve all image records
-    db.execute("SELECT * FROM snapshot INNER JOIN tiled_image ON snapshot.id = tiled_image.snapshot_id INNER JOIN "
-               "tile ON tiled_image.id = tile.tiled_image_id WHERE measurement_label = %s;", [experiment])
-    for row in db:
-        # Get the local time and timezone
-        timestamp = row["time_stamp"]
-        # Convert from local time to UTC
-        utc = timestamp.astimezone(utc_tz)
-        # Construct the snapshot ID
-        snapshot_id = f"snapshot{row['snapshot_id']}"
-        # Snapshot date for the image path
-        snapshot_date = utc.strftime("%Y-%m-%d")
-        # Construct the image filename
-        image_name = os.path.join(row["id_tag"], snapshot_date, snapshot_id,
-                                  f"{row['camera_label']}_{row['tiled_image_id']}_{row['frame']}.png")
+    query = sql.SQL("SELECT {} FROM snapshot INNER JOIN tiled_image ON snapshot.id = tiled_image.snapshot_id "
+                    "INNER JOIN tile ON tiled_image.id = tile.tiled_image_id WHERE measurement_label = %s").format(
+        _select_columns(columns=IMAGE_COLUMNS, extra_columns=extra_columns))
+    condition, params = _snapshot_filter(column="snapshot.id", since=since,
+                                         refresh=_incomplete_snapshots(metadata=metadata))
+    query += condition
+    params = [experiment] + params
+    # Formatted timestamps by snapshot, the tiles of a snapshot share its timestamp
+    snapshot_times = {}
+    for row in _execute(db=db, query=query, params=params, fetch_size=fetch_size, bulk=bulk):
+        times = snapshot_times.get(row["snapshot_id"])
+        if times is None:
+            times = _format_timestamps(timestamp=row["time_stamp"], utc_tz=utc_tz)
+            snapshot_times[row["snapshot_id"]] = times
+        image_name = _image_name(row=row, snapshot_id=row["snapshot_id"], times=times)
         if image_name not in metadata["images"]:
-            meta["images"][image_name] = {
-                "snapshot": snapshot_id,
-                "barcode": row["id_tag"],
-                "cartag": row["car_tag"],
-                "timestamp": utc.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
-                "local_time": timestamp.strftime("%Y-%m-%dT%H:%M:%S.%f%z"),
-                "camera_label": row["camera_label"],
-                "tiled_image_id": row["tiled_image_id"],
-                "frame": row["frame"],
-                "raw_image_oid": row["raw_image_oid"],
-                "rotate_flip_type": row["rotate_flip_type"],
-                "dataformat": str(row["dataformat"]),
-                "width": row["width"],
-                "height": row["height"]
-            }
-            camera_meta = _parse_camera_label(config=config, camera_label=row["camera_label"])
-            meta["images"][image_name].update(camera_meta)
-    return meta
+            images[image_name] = _image_record(row=row, snapshot_id=row["snapshot_id"], times=times,
+                                               extra_columns=extra_columns, config=config)
+    return images
+
+
+def fetch_experiment(db, metadata, experiment, config, fetch_size=None, since=None, bulk=False):
+    """Query the database once to retrieve the snapshot and image records that are not in the dataset metadata.
+
+    The snapshot, tiled_image and tile tables are joined in a single query ordered by snapshot, so each snapshot
+    timestamp is converted once for the snapshot and all of its images.
+
+    Keyword arguments:
+    db = Database cursor object.
+    metadata = Dataset metadata.
+    experiment = Experiment/Measurement label.
+    config = Instance of the class Config.
+    fetch_size = Stream rows from a server-side cursor, fetching this many rows at a time (default = None, fetch all
+                 rows at once).
+    since = Only retrieve snapshots with an ID greater than this watermark, and the snapshots that were incomplete
+            when they were synced (default = None, all snapshots).
+    bulk = Stream rows with a binary COPY instead of a cursor, for large initial syncs (default = False).
+
+    Returns:
+    environment = New and updated environment (snapshot) records.
+    images = New image records.
+
+    :param db: psycopg2.extras.DictCursor
+    :param metadata: dict
+    :param experiment: str
+    :param config: dsf.data.lemnatec.config.Config
+    :param fetch_size: int
+    :param since: int
+    :param bulk: bool
+    :return environment: dict
+    :return images: dict
+    """
+    environment = {}
+    images = {}
+
+    # Create a UTC timezone
+    utc_tz = ZoneInfo("UTC")
+
+    # Extra columns to add to the records
+    snapshot_columns = config.extra_columns.get("snapshot", [])
+    image_columns = config.extra_columns.get("image", [])
+    extra_columns = snapshot_columns + [column for column in image_columns if column not in snapshot_columns]
+
+    # Stream the snapshots and their images, converting each snapshot timestamp once
+    for row, tiles in iter_experiment(db=db, experiment=experiment, extra_columns=extra_columns,
+                                      fetch_size=fetch_size, since=since, bulk=bulk,
+                                      refresh=_incomplete_snapshots(metadata=metadata)):
+        snapshot_id = row["id"]
+        times = _format_timestamps(timestamp=row["time_stamp"], utc_tz=utc_tz)
+        snapshot = f"snapshot{snapshot_id}"
+        # Add the snapshots that have not been recorded in the dataset metadata or were incomplete
+        if _needs_update(metadata=metadata, snapshot=snapshot):
+            record = _environment_record(row=row, times=times, extra_columns=snapshot_columns)
+            if record != metadata["environment"].get(snapshot):
+                environment[snapshot] = record
+        for tile in tiles:
+            image_name = _image_name(row=tile, snapshot_id=snapshot_id, times=times)
+            if image_name not in metadata["images"]:
+                images[image_name] = _image_record(row=tile, snapshot_id=snapshot_id, times=times,
+                                                   extra_columns=image_columns, config=config)
+    return environment, images
+
+
+def iter_experiment(db, experiment, extra_columns=None, fetch_size=None, since=None, bulk=False, refresh=None):
+    """Stream the snapshots of an experiment together with their image tiles.
+
+    The measurement label filter is applied in the database and the snapshot, tiled_image and tile tables are joined
+    in a single query ordered by snapshot, so only the rows of one snapshot are held in memory at a time.
+
+    Keyword arguments:
+    db = Database cursor object.
+    experiment = Experiment/Measurement label.
+    extra_columns = Additional snapshot, tiled_image or tile columns to select (default = None).
+    fetch_size = Stream rows from a server-side cursor, fetching this many rows at a time (default = None, fetch all
+                 rows at once).
+    since = Only retrieve snapshots with an ID greater than this watermark (default = None, all snapshots).
+    refresh = IDs of snapshots at or below the watermark to retrieve again (default = None).
+    bulk = Stream rows with a binary COPY instead of a cursor, for large initial syncs (default = False).
+
+    Returns:
+    snapshots = Iterator of (snapshot row, list of tile rows) tuples. Snapshots without images (e.g. watering jobs)
+                have an empty list of tile rows.
+
+    :param db: psycopg2.extras.DictCursor
+    :param experiment: str
+    :param extra_columns: list
+    :param fetch_size: int
+    :param since: int
+    :param bulk: bool
+    :param refresh: list
+    :return snapshots: iterator
+    """
+    # Query the database to retrieve all snapshots and their images (if any)
+    query = sql.SQL("SELECT {} FROM snapshot LEFT JOIN tiled_image ON snapshot.id = tiled_image.snapshot_id "
+                    "LEFT JOIN tile ON tiled_image.id = tile.tiled_image_id WHERE measurement_label = %s").format(
+        _select_columns(columns=EXPERIMENT_COLUMNS, extra_columns=extra_columns or []))
+    condition, params = _snapshot_filter(column="snapshot.id", since=since, refresh=refresh)
+    query += condition + sql.SQL(" ORDER BY snapshot.id")
+    params = [experiment] + params
+    snapshot = None
+    tiles = []
+    for row in _execute(db=db, query=query, params=params, fetch_size=fetch_size, bulk=bulk):
+        if snapshot is None or row["id"] != snapshot["id"]:
+            # First row of a new snapshot
+            if snapshot is not None:
+                yield snapshot, tiles
+            snapshot = row
+            tiles = []
+        # Snapshots without images have no tile columns
+        if row["tiled_image_id"] is not None:
+            tiles.append(row)
+    if snapshot is not None:
+        yield snapshot, tiles
+
+
+def list_experiments(db, pattern="%"):
+    """Query the database for the experiments (measurement labels) that match a pattern.
+
+    Keyword arguments:
+    db = Database cursor object.
+    pattern = SQL LIKE pattern for the measurement labels (default = "%", all experiments).
+
+    Returns:
+    experiments = Sorted list of measurement labels.
+
+    :param db: psycopg2.extras.DictCursor
+    :param pattern: str
+    :return experiments: list
+    """
+    db.execute(sql.SQL("SELECT DISTINCT measurement_label FROM snapshot WHERE measurement_label LIKE %s "
+                       "ORDER BY measurement_label"), [pattern])
+    return [row["measurement_label"] for row in db]
+
+
+def _incomplete_snapshots(metadata):
+    """Get the IDs of the snapshots that were incomplete (e.g. still being imaged) when they were synced."""
+    return sorted(int(snapshot[len("snapshot"):]) for snapshot, record in metadata["environment"].items()
+                  if not record["completed"])
+
+
+def _needs_update(metadata, snapshot):
+    """Check whether a snapshot record is missing from the dataset metadata or was incomplete."""
+    record = metadata["environment"].get(snapshot)
+    return record is None or not record["completed"]
+
+
+def _snapshot_filter(column, since, refresh):
+    """Build the snapshot ID condition and parameters of an incremental query."""
+    if since is None:
+        return sql.SQL(""), []
+    if refresh:
+        # Snapshots at or below the watermark that were incomplete are retrieved again
+        return sql.SQL(" AND ({column} > %s OR {column} = ANY(%s))").format(column=sql.SQL(column)), [since, refresh]
+    return sql.SQL(" AND {column} > %s").format(column=sql.SQL(column)), [since]
+
+
+def _format_timestamps(timestamp, utc_tz):
+    """Format a snapshot timestamp for the metadata records.
+
+    Keyword arguments:
+    timestamp = Snapshot local time.
+    utc_tz = UTC timezone.
+
+    Returns:
+    times = Dictionary of the UTC timestamp, local time, and UTC date.
+
+    :param timestamp: datetime.datetime
+    :param utc_tz: zoneinfo.ZoneInfo
+    :return times: dict
+    """
+    # Convert from local time to UTC, formatted as %Y-%m-%dT%H:%M:%S.%fZ (isoformat is faster than strftime)
+    utc = timestamp.astimezone(utc_tz).replace(tzinfo=None).isoformat(timespec="microseconds") + "Z"
+    return {
+        "timestamp": utc,
+        "local_time": timestamp.strftime("%Y-%m-%dT%H:%M:%S.%f%z"),
+        # %Y-%m-%d
+        "date": utc[:10]
+    }
+
+
+def _environment_record(row, times, extra_columns):
+    """Build an environment (snapshot) record.
+
+    Keyword arguments:
+    row = Snapshot database row.
+    times = Formatted snapshot timestamps.
+    extra_columns = Additional columns to copy from the row.
+
+    Returns:
+    record = Environment record.
+
+    :param row: dict
+    :param times: dict
+    :param extra_columns: list
+    :return record: dict
+    """
+    record = {
+        "barcode": row["id_tag"],
+        "cartag": row["car_tag"],
+        "timestamp": times["timestamp"],
+        "local_time": times["local_time"],
+        "weight_before": row["weight_before"],
+        "weight_after": row["weight_after"],
+        "water_amount": row["water_amount"],
+        "completed": row["completed"]
+    }
+    for column in extra_columns:
+        record[column] = row[column]
+    return record
+
+
+def _image_name(row, snapshot_id, times):
+    """Build the image relative path, barcode/date/snapshotID/camera_tiledimageID_frame.png.
+
+    Keyword arguments:
+    row = Image database row.
+    snapshot_id = Snapshot database ID.
+    times = Formatted snapshot timestamps.
+
+    Returns:
+    image_name = Image relative path.
+
+    :param row: dict
+    :param snapshot_id: int
+    :param times: dict
+    :return image_name: str
+    """
+    return os.path.join(row["id_tag"], times["date"], f"snapshot{snapshot_id}",
+                        f"{row['camera_label']}_{row['tiled_image_id']}_{row['frame']}.png")
+
+
+def _image_record(row, snapshot_id, times, extra_columns, config):
+    """Build an image record.
+
+    Keyword arguments:
+    row = Image database row.
+    snapshot_id = Snapshot database ID.
+    times = Formatted snapshot timestamps.
+    extra_columns = Additional columns to copy from the row.
+    config = Instance of the class Config.
+
+    Returns:
+    record = Image record.
+
+    :param row: dict
+    :param snapshot_id: int
+    :param times: dict
+    :param extra_columns: list
+    :param config: dsf.data.lemnatec.config.Config
+    :return record: dict
+    """
+    record = {
+        "snapshot": f"snapshot{snapshot_id}",
+        "barcode": row["id_tag"],
+        "cartag": row["car_tag"],
+        "timestamp": times["timestamp"],
+        "local_time": times["local_time"],
+        "camera_label": row["camera_label"],
+        "tiled_image_id": row["tiled_image_id"],
+        "frame": row["frame"],
+        "raw_image_oid": row["raw_image_oid"],
+        "rotate_flip_type": row["rotate_flip_type"],
+        "dataformat": str(row["dataformat"]),
+        "width": row["width"],
+        "height": row["height"]
+    }
+    for column in extra_columns:
+        record[column] = row[column]
+    camera_meta = _parse_camera_label(config=config, camera_label=row["camera_label"])
+    record.update(camera_meta)
+    return record
+
+
+def _select_columns(columns, extra_columns):
+    """Build the column list of a SELECT statement.
+
+    Keyword arguments:
+    columns = Column names, optionally qualified by table name.
+    extra_columns = Additional column names, optionally qualified by table name (e.g. tile.id). The values are
+                    returned under the name as given.
+
+    Returns:
+    select = SQL column list.
+
+    :param columns: list
+    :param extra_columns: list
+    :return select: psycopg.sql.Composed
+    """
+    fields = [sql.Identifier(*column.split(".")) for column in columns]
+    for column in extra_columns:
+        fields.append(sql.SQL("{} AS {}").format(sql.Identifier(*column.split(".")), sql.Identifier(column)))
+    return sql.SQL(", ").join(fields)
+
+
+def _execute(db, query, params, fetch_size=None, bulk=False):
+    """Execute a query and iterate over the result rows.
+
+    Keyword arguments:
+    db = Database cursor object.
+    query = SQL query.
+    params = Query parameters.
+    fetch_size = Stream rows from a named server-side cursor, fetching this many rows at a time (default = None, the
+                 client cursor fetches all rows at once).
+    bulk = Stream rows with COPY (query) TO STDOUT in binary format (default = False).
+
+    Returns:
+    rows = Iterator of result rows.
+
+    :param db: psycopg.Cursor
+    :param query: psycopg.sql.Composable
+    :param params: list
+    :param fetch_size: int
+    :param bulk: bool
+    :return rows: iterator
+    """
+    if bulk:
+        # Get the result column names and types without running the query
+        db.execute(sql.SQL("{} LIMIT 0").format(query), params)
+        names = [column.name for column in db.description]
+        types = [column.type_code for column in db.description]
+        with db.copy(sql.SQL("COPY ({}) TO STDOUT (FORMAT BINARY)").format(query), params) as copy:
+            # Parse the binary rows into the same Python types as the cursor would
+            copy.set_types(types)
+            for row in copy.rows():
+                yield dict(zip(names, row))
+    elif fetch_size is None:
+        db.execute(query, params)
+        yield from db
+    else:
+        with db.connection.cursor(name=f"dsf_query_{next(_cursor_ids)}", row_factory=dict_row) as cursor:
+            cursor.itersize = fetch_size
+            cursor.execute(query, params)
+            yield from cursor
 
 
 def _parse_camera_label(config, camera_label):
-    camera_meta = {}
-    for term in config.metadata:
-        match = re.search(config.metadata[term], camera_label, flags=re.IGNORECASE)
-        if match is not None:
-            camera_meta[term] = match.groups()[0]
+    """Parse metadata terms from a camera label.
+
+    Results are cached on the config since an experiment only has a handful of distinct camera labels.
+
+    Keyword arguments:
+    config = Instance of the class Config.
+    camera_label = Camera label.
+
+    Returns:
+    camera_meta = Dictionary of metadata terms found in the camera label.
+
+    :param config: dsf.data.lemnatec.config.Config
+    :param camera_label: str
+    :return camera_meta: dict
+    """
+    camera_meta = config.camera_labels.get(camera_label)
+    if camera_meta is None:
+        if config.camera_patterns is None:
+            config.camera_patterns = {term: re.compile(config.metadata[term], flags=re.IGNORECASE)
+                                      for term in config.metadata}
+        camera_meta = {}
+        for term in config.camera_patterns:
+            match = config.camera_patterns[term].search(camera_label)
+            if match is not None:
+                camera_meta[term] = match.groups()[0]
+        config.camera_labels[camera_label] = camera_meta
     return camera_meta
@@ -1,17 +1,143 @@
 import os
 import json
+import time
+import threading
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Callable
 from dsf import __version__ as version
+from dsf.data.lemnatec.store import is_sharded
+from dsf.data.lemnatec.store import init_store
+from dsf.data.lemnatec.store import load_store
+from dsf.data.lemnatec.store import save_store
+from dsf.data.lemnatec.store import read_records
+from dsf.data.lemnatec.store import atomic_write
+from dsf.data.lemnatec.store import load_manifest
+from dsf.data.lemnatec.sqlite import is_sqlite
+from dsf.data.lemnatec.sqlite import init_sqlite
+from dsf.data.lemnatec.sqlite import load_sqlite
+from dsf.data.lemnatec.sqlite import save_sqlite
+from dsf.data.lemnatec.sqlite import iter_sqlite_records
+from dsf.data.lemnatec.sqlite import sqlite_summary
+from dsf.data.lemnatec.sqlite import load_sqlite_dataset
+from dsf.data.lemnatec.records import ImageRecord
+from dsf.data.lemnatec.records import json_default
+from dsf.data.lemnatec.jsonstream import iter_json_section
+from dsf.data.lemnatec.jsonstream import load_json_section
+from dsf.data.lemnatec.jsonstream import load_json_sections
 
 
-def init_dataset(dataset_dir, config):
+# Image transfer journal filename
+JOURNAL_FILE = "transfers.journal"
+
+
+@dataclass
+class Serializer:
+    """Class for reading and writing metadata files with a JSON library."""
+    name: str
+    # Parse JSON bytes
+    loads: Callable
+    # Serialize to JSON bytes, dumps(obj, compact)
+    dumps: Callable
+
+
+def _json_dumps(obj, compact):
+    if compact:
+        return json.dumps(obj, separators=(",", ":"), default=json_default).encode("utf-8")
+    return json.dumps(obj, indent=4, default=json_default).encode("utf-8")
+
+
+def _orjson_dumps(obj, compact):
+    # orjson only supports two space indentation
+    return orjson.dumps(obj, default=json_default, option=0 if compact else orjson.OPT_INDENT_2)
+
+
+# Available metadata serializers, the fastest installed one is the default
+SERIALIZERS = {"json": Serializer(name="json", loads=json.loads, dumps=_json_dumps)}
+try:
+    import orjson
+except ImportError:
+    orjson = None
+else:
+    SERIALIZERS["orjson"] = Serializer(name="orjson", loads=orjson.loads, dumps=_orjson_dumps)
+
+
+def get_serializer(name=None):
+    """Get a metadata serializer.
+
+    Keyword arguments:
+    name = Serializer name, json or orjson (default = None, orjson if it is installed, otherwise json).
+
+    Returns:
+    serializer = Instance of the class Serializer.
+
+    :param name: str
+    :return serializer: dsf.data.lemnatec.dataset.Serializer
+    """
+    if name is None:
+        name = "orjson" if "orjson" in SERIALIZERS else "json"
+    if name not in SERIALIZERS:
+        raise ValueError(f"Unknown metadata serializer {name}, available serializers: {', '.join(SERIALIZERS)}.")
+    return SERIALIZERS[name]
+
+
+@dataclass
+class Inventory:
+    """Class for tracking the files and directories in a dataset directory."""
+    dataset_dir: str
+    files: set = field(default_factory=set)
+    dirs: set = field(default_factory=set)
+
+    def exists(self, path):
+        """Check whether a file exists in the dataset.
+
+        Keyword arguments:
+        path = File path relative to the dataset directory.
+
+        :param path: str
+        :return exists: bool
+        """
+        return path in self.files
+
+    def makedirs(self, path):
+        """Make a directory (and its parents) in the dataset if it does not exist.
+
+        Keyword arguments:
+        path = Directory path relative to the dataset directory.
+
+        :param path: str
+        """
+        if path not in self.dirs:
+            os.makedirs(os.path.join(self.dataset_dir, path), exist_ok=True)
+            while path and path not in self.dirs:
+                self.dirs.add(path)
+                path = os.path.dirname(path)
+
+    def add(self, path):
+        """Record a new file in the dataset.
+
+        Keyword arguments:
+        path = File path relative to the dataset directory.
+
+        :param path: str
+        """
+        self.files.add(path)
+
+
+def init_dataset(dataset_dir, config, layout="json"):
     """Initialize the dataset layout.
 
     Keyword arguments:
     dataset_dir = Dataset directory path.
     config = Instance of the class Config.
+    layout = Metadata layout of a new dataset (default = "json"). Existing datasets keep their layout.
+             json = A single metadata.json file.
+             sharded = Per-day JSON-lines shards and a manifest.
+             sqlite = A SQLite database with indexed barcode, snapshot, timestamp and imgtype/camera columns.
 
     :param dataset_dir: str
     :param config: dsf.data.lemnatec.config.Config
+    :param layout: str
     """
     # Make the dataset directory if it does not exist
     os.makedirs(dataset_dir, exist_ok=True)
@@ -28,38 +154,408 @@ def init_dataset(dataset_dir, config):
     }
     # Dataset metadata file
     metadata_file = os.path.join(dataset_dir, "metadata.json")
-    # If the metadata file does not exist create an empty JSON file
-    if not os.path.exists(metadata_file):
+    # Existing datasets keep the metadata layout they were created with
+    if os.path.exists(metadata_file) or is_sharded(dataset_dir=dataset_dir) or is_sqlite(dataset_dir=dataset_dir):
+        return
+    if layout == "sharded":
+        # Create an empty sharded metadata store
+        init_store(dataset_dir=dataset_dir, dataset=metadata["dataset"])
+    elif layout == "sqlite":
+        # Create an empty SQLite metadata database
+        init_sqlite(dataset_dir=dataset_dir, dataset=metadata["dataset"])
+    elif layout == "json":
+        # Create an empty JSON file
         with open(metadata_file, "w") as fp:
             json.dump(metadata, fp, indent=4)
+    else:
+        raise ValueError(f"Unknown dataset layout {layout}, use json, sharded or sqlite.")
 
 
-def load_dataset(dataset_dir):
+def load_dataset(dataset_dir, serializer=None, compact_records=False):
     """Load the dataset metadata.
 
     Keyword arguments:
     dataset_dir = Dataset directory path.
+    serializer = Name of the JSON serializer used to parse metadata.json (default = None, see get_serializer).
+                 Indented and compact files are both read. Compact records are parsed incrementally instead.
+    compact_records = Load the images as read-only ImageRecord objects instead of dictionaries, which use a fraction
+                      of the memory (default = False). Records are converted as they are read, so the dictionary form
+                      of the images is never held in memory.
 
     Returns:
     meta = Dataset metadata.
 
     :param dataset_dir: str
+    :param serializer: str
+    :param compact_records: bool
     :return meta: dict
     """
-    with open(os.path.join(dataset_dir, "metadata.json"), "r") as fp:
-        meta = json.load(fp)
-        return meta
+    if compact_records:
+        return _load_compact(dataset_dir=dataset_dir)
+    if is_sharded(dataset_dir=dataset_dir):
+        return load_store(dataset_dir=dataset_dir)
+    if is_sqlite(dataset_dir=dataset_dir):
+        return load_sqlite(dataset_dir=dataset_dir)
+    with open(os.path.join(dataset_dir, "metadata.json"), "rb") as fp:
+        return get_serializer(name=serializer).loads(fp.read())
+
+
+def _load_compact(dataset_dir):
+    """Load the dataset metadata, building the image records one at a time as they are read."""
+    if not is_sharded(dataset_dir=dataset_dir) and not is_sqlite(dataset_dir=dataset_dir):
+        return load_json_sections(filename=os.path.join(dataset_dir, "metadata.json"), hooks={"images": ImageRecord})
+    images = iter_records(dataset_dir=dataset_dir, section="images")
+    return {
+        "dataset": open_dataset(dataset_dir=dataset_dir).dataset(),
+        "environment": dict(iter_records(dataset_dir=dataset_dir, section="environment")),
+        "images": {name: ImageRecord(record) for name, record in images}
+    }
 
 
-def save_dataset(dataset_dir, metadata):
+def save_dataset(dataset_dir, metadata, compact=None, serializer=None):
     """Save the dataset metadata.
 
     Keyword arguments:
     dataset_dir = Dataset directory path.
     metadata = Metadata dictionary
+    compact = Write metadata.json without indentation (default = None, keep the format of the existing file).
+    serializer = Name of the JSON serializer used to write metadata.json (default = None, see get_serializer).
 
     :param dataset_dir: str
     :param metadata: dict
+    :param compact: bool
+    :param serializer: str
+    """
+    if is_sharded(dataset_dir=dataset_dir):
+        # Only new records are appended to the metadata shards
+        save_store(dataset_dir=dataset_dir, metadata=metadata)
+        return
+    if is_sqlite(dataset_dir=dataset_dir):
+        # Only new records are inserted into the SQLite database
+        save_sqlite(dataset_dir=dataset_dir, metadata=metadata)
+        return
+    metadata_file = os.path.join(dataset_dir, "metadata.json")
+    if compact is None:
+        compact = _is_compact(metadata_file=metadata_file)
+    # Write to a temporary file and rename it so a crash cannot truncate the metadata
+    atomic_write(filename=metadata_file, data=get_serializer(name=serializer).dumps(metadata, compact))
+
+
+def _is_compact(metadata_file):
+    """Check whether an existing metadata file was written without indentation."""
+    if not os.path.exists(metadata_file):
+        return False
+    with open(metadata_file, "rb") as fp:
+        # Compact files have no whitespace after the opening brace
+        return fp.read(2) == b'{"'
+
+
+def iter_records(dataset_dir, section):
+    """Stream the records of a metadata section.
+
+    Records are read one at a time, metadata.json sections are parsed incrementally.
+
+    Keyword arguments:
+    dataset_dir = Dataset directory path.
+    section = Metadata section (environment or images).
+
+    Returns:
+    records = Iterator of (name, record) tuples.
+
+    :param dataset_dir: str
+    :param section: str
+    :return records: iterator
+    """
+    if is_sharded(dataset_dir=dataset_dir):
+        yield from read_records(dataset_dir=dataset_dir, section=section)
+    elif is_sqlite(dataset_dir=dataset_dir):
+        yield from iter_sqlite_records(dataset_dir=dataset_dir, table=section)
+    else:
+        yield from iter_json_section(filename=os.path.join(dataset_dir, "metadata.json"), section=section)
+
+
+class DatasetHandle:
+    """Read-only dataset handle that loads metadata on demand, without materializing the image records.
+
+    Keyword arguments:
+    dataset_dir = Dataset directory path.
+
+    :param dataset_dir: str
+    """
+    def __init__(self, dataset_dir):
+        self.dataset_dir = dataset_dir
+        if is_sharded(dataset_dir=dataset_dir):
+            self.layout = "sharded"
+        elif is_sqlite(dataset_dir=dataset_dir):
+            self.layout = "sqlite"
+        else:
+            self.layout = "json"
+
+    def dataset(self):
+        """Load the dataset section of the metadata.
+
+        Returns:
+        dataset = Dataset section.
+
+        :return dataset: dict
+        """
+        if self.layout == "sharded":
+            return load_manifest(dataset_dir=self.dataset_dir)["dataset"]
+        if self.layout == "sqlite":
+            return load_sqlite_dataset(dataset_dir=self.dataset_dir)
+        return load_json_section(filename=os.path.join(self.dataset_dir, "metadata.json"), section="dataset")
+
+    def records(self, section):
+        """Stream the records of a metadata section.
+
+        Keyword arguments:
+        section = Metadata section (environment or images).
+
+        Returns:
+        records = Iterator of (name, record) tuples.
+
+        :param section: str
+        :return records: iterator
+        """
+        return iter_records(dataset_dir=self.dataset_dir, section=section)
+
+    def count(self, section):
+        """Count the records of a metadata section.
+
+        Keyword arguments:
+        section = Metadata section (environment or images).
+
+        Returns:
+        count = Number of records.
+
+        :param section: str
+        :return count: int
+        """
+        if self.layout == "sharded":
+            return load_manifest(dataset_dir=self.dataset_dir)["sections"][section]["count"]
+        if self.layout == "sqlite":
+            return sqlite_summary(dataset_dir=self.dataset_dir)["snapshots" if section == "environment" else section]
+        return sum(1 for _ in self.records(section=section))
+
+    def timestamp_range(self):
+        """Get the first and last snapshot timestamps.
+
+        Returns:
+        first = First snapshot UTC timestamp, or None if the dataset has no snapshots.
+        last = Last snapshot UTC timestamp, or None if the dataset has no snapshots.
+
+        :return first: str
+        :return last: str
+        """
+        if self.layout == "sqlite":
+            summary = sqlite_summary(dataset_dir=self.dataset_dir)
+            return summary["first_timestamp"], summary["last_timestamp"]
+        first = None
+        last = None
+        # UTC timestamps have a fixed width format, so they sort as strings
+        for _, record in self.records(section="environment"):
+            timestamp = record["timestamp"]
+            if first is None or timestamp < first:
+                first = timestamp
+            if last is None or timestamp > last:
+                last = timestamp
+        return first, last
+
+
+def open_dataset(dataset_dir):
+    """Open a read-only handle to the dataset metadata.
+
+    Keyword arguments:
+    dataset_dir = Dataset directory path.
+
+    Returns:
+    handle = Instance of the class DatasetHandle.
+
+    :param dataset_dir: str
+    :return handle: dsf.data.lemnatec.dataset.DatasetHandle
+    """
+    return DatasetHandle(dataset_dir=dataset_dir)
+
+
+def merge_records(metadata, environment=None, images=None):
+    """Add new environment and image records to the dataset metadata in place.
+
+    Environment records that are already in the metadata (snapshots that were incomplete) are replaced.
+
+    Keyword arguments:
+    metadata = Dataset metadata.
+    environment = New and updated environment (snapshot) records (default = None).
+    images = New image records (default = None).
+
+    :param metadata: dict
+    :param environment: dict
+    :param images: dict
+    """
+    if environment:
+        metadata["environment"].update(environment)
+    if images:
+        metadata["images"].update(images)
+
+
+def get_watermark(metadata):
+    """Get the ID of the newest snapshot synced from the database.
+
+    Keyword arguments:
+    metadata = Dataset metadata.
+
+    Returns:
+    snapshot_id = Snapshot ID watermark, or None if the dataset has not been synced.
+
+    :param metadata: dict
+    :return snapshot_id: int
+    """
+    watermark = metadata["dataset"].get("watermark")
+    if watermark is None:
+        return None
+    return watermark["snapshot_id"]
+
+
+def update_watermark(metadata):
+    """Record the newest completed snapshot in the dataset metadata.
+
+    The watermark is kept below the oldest incomplete snapshot (e.g. still being imaged), so incomplete snapshots and
+    the snapshots after them are synced again.
+
+    Keyword arguments:
+    metadata = Dataset metadata.
+
+    :param metadata: dict
+    """
+    snapshot_ids = {snapshot: int(snapshot[len("snapshot"):]) for snapshot in metadata["environment"]}
+    incomplete = [snapshot_ids[snapshot] for snapshot in metadata["environment"]
+                  if not metadata["environment"][snapshot]["completed"]]
+    # Snapshot IDs at or above the oldest incomplete snapshot cannot be covered by the watermark
+    limit = min(incomplete) if incomplete else None
+    watermark = metadata["dataset"].get("watermark")
+    if watermark is not None and limit is not None and watermark["snapshot_id"] >= limit:
+        watermark = None
+    for snapshot, snapshot_id in snapshot_ids.items():
+        if metadata["environment"][snapshot]["completed"] and (limit is None or snapshot_id < limit):
+            if watermark is None or snapshot_id > watermark["snapshot_id"]:
+                watermark = {"snapshot_id": snapshot_id, "timestamp": metadata["environment"][snapshot]["timestamp"]}
+    if watermark is not None:
+        metadata["dataset"]["watermark"] = watermark
+    else:
+        metadata["dataset"].pop("watermark", None)
+
+
+def scan_dataset(dataset_dir):
+    """Inventory the existing files and directories in a dataset with a single directory sweep.
+
+    Keyword arguments:
+    dataset_dir = Dataset directory path.
+
+    Returns:
+    inventory = Instance of the class Inventory.
+
+    :param dataset_dir: str
+    :return inventory: dsf.data.lemnatec.dataset.Inventory
+    """
+    inventory = Inventory(dataset_dir=dataset_dir)
+    if not os.path.isdir(dataset_dir):
+        return inventory
+    # Directories to scan, relative to the dataset directory
+    stack = [""]
+    while stack:
+        rel_dir = stack.pop()
+        with os.scandir(os.path.join(dataset_dir, rel_dir)) as entries:
+            for entry in entries:
+                path = os.path.join(rel_dir, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    inventory.dirs.add(path)
+                    stack.append(path)
+                else:
+                    inventory.files.add(path)
+    return inventory
+
+
+class Journal:
+    """Append-only record of image transfer states (fetched, written, failed) in a dataset directory.
+
+    Keyword arguments:
+    dataset_dir = Dataset directory path.
+    checkpoint_interval = Minimum number of seconds between checkpoints that flush the journal to disk (default = None,
+                          only checkpoint when the journal is closed).
+    reset = Discard the states recorded by previous runs (default = False).
+
+    :param dataset_dir: str
+    :param checkpoint_interval: float
+    :param reset: bool
+    """
+    def __init__(self, dataset_dir, checkpoint_interval=None, reset=False):
+        journal_file = os.path.join(dataset_dir, JOURNAL_FILE)
+        if not reset and os.path.exists(journal_file):
+            with open(journal_file, "rb+") as fp:
+                # Finish a record that was partially written (e.g. after a crash) so it does not swallow the next one
+                if fp.seek(0, os.SEEK_END) > 0:
+                    fp.seek(-1, os.SEEK_END)
+                    if fp.read(1) != b"\n":
+                        fp.write(b"\n")
+        self.fp = open(journal_file, "w" if reset else "a", buffering=1)
+        self.lock = threading.Lock()
+        self.checkpoint_interval = checkpoint_interval
+        self.last_checkpoint = time.monotonic()
+        self.checkpoints = 0
+
+    def record(self, image, state):
+        """Append an image state to the journal.
+
+        Keyword arguments:
+        image = Image relative path.
+        state = Transfer state.
+
+        :param image: str
+        :param state: str
+        """
+        with self.lock:
+            self.fp.write(f"{state}\t{image}\n")
+            interval = self.checkpoint_interval
+            if interval is not None and time.monotonic() - self.last_checkpoint >= interval:
+                self._checkpoint()
+
+    def checkpoint(self):
+        """Flush the states recorded since the last checkpoint to disk."""
+        with self.lock:
+            self._checkpoint()
+
+    def _checkpoint(self):
+        # Only the records appended since the last checkpoint are written
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+        self.last_checkpoint = time.monotonic()
+        self.checkpoints += 1
+
+    def close(self):
+        self.checkpoint()
+        self.fp.close()
+
+
+def load_journal(dataset_dir):
+    """Replay the image transfer journal.
+
+    Keyword arguments:
+    dataset_dir = Dataset directory path.
+
+    Returns:
+    states = Dictionary of the latest transfer state for each image, or None if there is no journal.
+
+    :param dataset_dir: str
+    :return states: dict
     """
-    with open(os.path.join(dataset_dir, "metadata.json"), "w") as fp:
-        json.dump(metadata, fp, indent=4)
+    journal_file = os.path.join(dataset_dir, JOURNAL_FILE)
+    if not os.path.exists(journal_file):
+        return None
+    states = {}
+    with open(journal_file, "r") as fp:
+        for line in fp:
+            # Skip partially written records (e.g. after a crash)
+            if not line.endswith("\n") or "\t" not in line:
+                continue
+            state, image = line.rstrip("\n").split("\t", 1)
+            states[image] = state
+    return states
@@ -0,0 +1,143 @@
+import os
+from datetime import datetime
+from datetime import timezone
+from dsf.data.lemnatec.dataset import iter_records
+
+
+# Column types of the exported tables. Other record fields (extra columns and camera label metadata) get their type
+# from a pass over all the records, strings are dictionary-encoded
+COLUMN_TYPES = {
+    "environment": {
+        "name": "string",
+        "barcode": "dictionary",
+        "cartag": "dictionary",
+        "timestamp": "timestamp",
+        "local_time": "string",
+        "weight_before": "float64",
+        "weight_after": "float64",
+        "water_amount": "float64",
+        "completed": "bool"
+    },
+    "images": {
+        "name": "string",
+        "snapshot": "dictionary",
+        "barcode": "dictionary",
+        "cartag": "dictionary",
+        "timestamp": "timestamp",
+        "local_time": "string",
+        "camera_label": "dictionary",
+        "tiled_image_id": "int64",
+        "frame": "int64",
+        "raw_image_oid": "int64",
+        "rotate_flip_type": "int64",
+        "dataformat": "dictionary",
+        "width": "int64",
+        "height": "int64"
+    }
+}
+
+
+def export_parquet(dataset_dir, outdir, row_group_size=100000):
+    """Export the environment and image metadata as Parquet tables.
+
+    The records are streamed into row groups, so only one row group is held in memory at a time. The table schema is
+    built by a first pass over the records, so fields that only appear in later records are exported. Requires the
+    optional pyarrow package.
+
+    Keyword arguments:
+    dataset_dir = Dataset directory path.
+    outdir = Output directory for the environment.parquet and images.parquet files.
+    row_group_size = Number of records per Parquet row group (default = 100000).
+
+    Returns:
+    counts = Number of records exported from each section.
+
+    :param dataset_dir: str
+    :param outdir: str
+    :param row_group_size: int
+    :return counts: dict
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Parquet export requires pyarrow, install it with: pip install pyarrow")
+    os.makedirs(outdir, exist_ok=True)
+    counts = {}
+    for section in COLUMN_TYPES:
+        counts[section] = 0
+        batch = []
+        schema = _schema(pa=pa, columns=_column_types(dataset_dir=dataset_dir, section=section))
+        filename = os.path.join(outdir, f"{section}.parquet")
+        with pq.ParquetWriter(filename, schema=schema, use_dictionary=True, compression="zstd") as writer:
+            for name, record in iter_records(dataset_dir=dataset_dir, section=section):
+                batch.append(dict(record, name=name))
+                if len(batch) == row_group_size:
+                    _write_row_group(pa=pa, writer=writer, batch=batch)
+                    counts[section] += len(batch)
+                    batch = []
+            if batch:
+                _write_row_group(pa=pa, writer=writer, batch=batch)
+                counts[section] += len(batch)
+    return counts
+
+
+def _write_row_group(pa, writer, batch):
+    """Write a batch of records as a row group."""
+    arrays = []
+    for field in writer.schema:
+        values = [record.get(field.name) for record in batch]
+        if pa.types.is_timestamp(field.type):
+            values = [None if value is None else
+                      datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=timezone.utc)
+                      for value in values]
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, type=field.type.value_type).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, type=field.type))
+    writer.write_table(pa.Table.from_arrays(arrays, schema=writer.schema))
+
+
+def _column_types(dataset_dir, section):
+    """Get the column types of a section from the field values of all its records."""
+    columns = dict(COLUMN_TYPES[section])
+    inferred = set()
+    for _, record in iter_records(dataset_dir=dataset_dir, section=section):
+        for key, value in record.items():
+            if value is None or (key in columns and key not in inferred):
+                continue
+            # Booleans are checked first because they are also integers
+            if isinstance(value, bool):
+                column_type = "bool"
+            elif isinstance(value, int):
+                column_type = "int64"
+            elif isinstance(value, float):
+                column_type = "float64"
+            elif isinstance(value, str):
+                column_type = "dictionary"
+            else:
+                raise ValueError(f"Cannot export the {type(value).__name__} value of the {section} field {key}.")
+            if key not in columns:
+                columns[key] = column_type
+                inferred.add(key)
+            elif columns[key] != column_type:
+                # Integer fields that also have float values are exported as floats
+                if {columns[key], column_type} == {"int64", "float64"}:
+                    columns[key] = "float64"
+                else:
+                    raise ValueError(f"The {section} field {key} has both {columns[key]} and {column_type} values.")
+    return columns
+
+
+def _schema(pa, columns):
+    """Build the table schema from the column types."""
+    types = {
+        "string": pa.string(),
+        "dictionary": pa.dictionary(pa.int32(), pa.string()),
+        # Metadata timestamps have microsecond precision
+        "timestamp": pa.timestamp("us", tz="UTC"),
+        "float64": pa.float64(),
+        "int64": pa.int64(),
+        "bool": pa.bool_()
+    }
+    return pa.schema([pa.field(name, types[column_type]) for name, column_type in columns.items()])
@@ -0,0 +1,178 @@
+import json
+import re
+
+
+# Characters read from the file at a time
+CHUNK_SIZE = 1 << 20
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r"[ \t\n\r]*")
+_delimiters = (" ", "\t", "\n", "\r", ",", "]", "}")
+
+
+class JSONStream:
+    """Incremental reader of the values in a JSON document, holding one chunk of the file in memory at a time.
+
+    Keyword arguments:
+    fp = JSON file object opened in text mode.
+    chunk_size = Number of characters read from the file at a time (default = CHUNK_SIZE).
+
+    :param fp: io.TextIOBase
+    :param chunk_size: int
+    """
+    def __init__(self, fp, chunk_size=CHUNK_SIZE):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        """Read the next chunk, dropping the part of the buffer that was already parsed."""
+        chunk = self.fp.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Get the next non-whitespace character without consuming it, or an empty string at the end of the file."""
+        while True:
+            self.pos = _whitespace.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) or not self._fill():
+                return self.buf[self.pos:self.pos + 1]
+
+    def expect(self, char):
+        """Consume the next non-whitespace character, which must be char."""
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' at position {self.pos} of the JSON chunk, found '{self.peek()}'.")
+        self.pos += 1
+
+    def value(self):
+        """Parse the next JSON value."""
+        self.peek()
+        while True:
+            try:
+                obj, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # The value continues in the next chunk
+                if not self._fill():
+                    raise
+                continue
+            # A number is complete when it is followed by a delimiter, otherwise it may continue in the next chunk
+            if isinstance(obj, (int, float)) and self.buf[end:end + 1] not in _delimiters and self._fill():
+                continue
+            self.pos = end
+            return obj
+
+    def members(self):
+        """Iterate over the (key, value) members of the JSON object that starts at the next character."""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key, self.value()
+            if self.peek() == "}":
+                self.pos += 1
+                return
+            self.expect(",")
+
+
+def iter_json_section(filename, section):
+    """Stream the records of a metadata.json section without parsing the rest of the file into memory.
+
+    Keyword arguments:
+    filename = Metadata JSON filename.
+    section = Metadata section (environment or images).
+
+    Returns:
+    records = Iterator of (name, record) tuples.
+
+    :param filename: str
+    :param section: str
+    :return records: iterator
+    """
+    with open(filename, "r") as fp:
+        stream = JSONStream(fp=fp)
+        if _seek_section(stream=stream, section=section):
+            yield from stream.members()
+
+
+def load_json_section(filename, section):
+    """Load one section of a metadata.json file, skipping the records of the other sections.
+
+    Keyword arguments:
+    filename = Metadata JSON filename.
+    section = Metadata section (e.g. dataset).
+
+    Returns:
+    value = Section value, or None if the file does not have the section.
+
+    :param filename: str
+    :param section: str
+    :return value: dict
+    """
+    with open(filename, "r") as fp:
+        stream = JSONStream(fp=fp)
+        if _seek_section(stream=stream, section=section):
+            return stream.value()
+    return None
+
+
+def load_json_sections(filename, hooks):
+    """Load a metadata.json file, converting the records of some sections as they are parsed.
+
+    Each record is converted before the next one is parsed, so the unconverted records are never all in memory.
+
+    Keyword arguments:
+    filename = Metadata JSON filename.
+    hooks = Conversion functions by section name, called with each record of the section.
+
+    Returns:
+    meta = Metadata with the converted records.
+
+    :param filename: str
+    :param hooks: dict
+    :return meta: dict
+    """
+    meta = {}
+    with open(filename, "r") as fp:
+        stream = JSONStream(fp=fp)
+        stream.expect("{")
+        while stream.peek() not in ("}", ""):
+            key = stream.value()
+            stream.expect(":")
+            if stream.peek() == "{":
+                # Objects are parsed one member at a time, parsing a large object as one value restarts it after
+                # every chunk
+                hook = hooks.get(key)
+                members = stream.members()
+                meta[key] = dict(members) if hook is None else {name: hook(record) for name, record in members}
+            else:
+                meta[key] = stream.value()
+            if stream.peek() == ",":
+                stream.pos += 1
+    return meta
+
+
+def _seek_section(stream, section):
+    """Advance the stream to the value of a top-level section, returning False if the document does not have it."""
+    stream.expect("{")
+    while stream.peek() not in ("}", ""):
+        key = stream.value()
+        stream.expect(":")
+        if key == section:
+            return True
+        # Skip the other sections one member at a time
+        if stream.peek() == "{":
+            for _ in stream.members():
+                pass
+        else:
+            stream.value()
+        if stream.peek() == ",":
+            stream.pos += 1
+    return False
@@ -0,0 +1,115 @@
+import sys
+from collections.abc import Mapping
+
+
+# Image record fields stored in slots, other fields (camera label metadata and extra columns) are stored as extras
+IMAGE_FIELDS = ("snapshot", "barcode", "cartag", "timestamp", "local_time", "camera_label", "tiled_image_id", "frame",
+                "raw_image_oid", "rotate_flip_type", "dataformat", "width", "height")
+# Shared tuples of extra field names, most records have the same extra fields
+_extra_keys = {}
+
+
+class ImageRecord(Mapping):
+    """Compact, read-only image record.
+
+    Field values are stored in slots instead of a per-record dictionary and strings are interned, so repeated values
+    (barcodes, camera labels, snapshot timestamps) are stored once. Records behave like (and compare equal to) the
+    dictionary form of the image record.
+
+    Keyword arguments:
+    record = Image record dictionary.
+
+    :param record: dict
+    """
+    __slots__ = IMAGE_FIELDS + ("_keys", "_values")
+
+    def __init__(self, record):
+        for name in IMAGE_FIELDS:
+            object.__setattr__(self, name, _intern(record.get(name)))
+        extras = tuple(sys.intern(key) for key in record if key not in IMAGE_FIELDS)
+        object.__setattr__(self, "_keys", _extra_keys.setdefault(extras, extras))
+        object.__setattr__(self, "_values", tuple(_intern(record[key]) for key in extras))
+
+    def __getitem__(self, key):
+        if key in IMAGE_FIELDS:
+            return getattr(self, key)
+        try:
+            return self._values[self._keys.index(key)]
+        except ValueError:
+            raise KeyError(key)
+
+    def __iter__(self):
+        yield from IMAGE_FIELDS
+        yield from self._keys
+
+    def __len__(self):
+        return len(IMAGE_FIELDS) + len(self._keys)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Image records are read-only, convert them with to_dict to modify them.")
+
+    def __reduce__(self):
+        return ImageRecord, (self.to_dict(),)
+
+    def __repr__(self):
+        return f"ImageRecord({self.to_dict()!r})"
+
+    def to_dict(self):
+        """Convert the record to the image record dictionary.
+
+        Returns:
+        record = Image record dictionary.
+
+        :return record: dict
+        """
+        return dict(self.items())
+
+
+def compact_images(metadata):
+    """Replace the image record dictionaries of the dataset metadata with compact image records, in place.
+
+    Keyword arguments:
+    metadata = Dataset metadata.
+
+    :param metadata: dict
+    """
+    images = metadata["images"]
+    for image in images:
+        if not isinstance(images[image], ImageRecord):
+            images[image] = ImageRecord(images[image])
+
+
+def expand_images(metadata):
+    """Replace the compact image records of the dataset metadata with image record dictionaries, in place.
+
+    Keyword arguments:
+    metadata = Dataset metadata.
+
+    :param metadata: dict
+    """
+    images = metadata["images"]
+    for image in images:
+        if isinstance(images[image], ImageRecord):
+            images[image] = images[image].to_dict()
+
+
+def json_default(obj):
+    """Serialize compact image records as dictionaries, for use as the default function of a JSON encoder.
+
+    Keyword arguments:
+    obj = Object that the JSON encoder cannot serialize.
+
+    Returns:
+    record = Image record dictionary.
+
+    :param obj: dsf.data.lemnatec.records.ImageRecord
+    :return record: dict
+    """
+    if isinstance(obj, ImageRecord):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _intern(value):
+    """Intern string values."""
+    return sys.intern(value) if isinstance(value, str) else value
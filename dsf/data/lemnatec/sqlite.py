@@ -0,0 +1,260 @@
+import os
+import json
+from dsf.data.lemnatec.records import json_default
+import sqlite3
+
+
+# SQLite metadata database filename
+SQLITE_FILE = "metadata.sqlite"
+# Record tables and their indexed columns
+TABLES = {
+    "environment": ["barcode", "timestamp"],
+    "images": ["snapshot", "barcode", "timestamp", "imgtype", "camera"]
+}
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dataset (id INTEGER PRIMARY KEY CHECK (id = 0), metadata TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS environment (name TEXT PRIMARY KEY, barcode TEXT, timestamp TEXT, record TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS images (name TEXT PRIMARY KEY, snapshot TEXT, barcode TEXT, timestamp TEXT, imgtype TEXT,
+                                   camera TEXT, record TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS environment_barcode ON environment (barcode, timestamp);
+CREATE INDEX IF NOT EXISTS environment_timestamp ON environment (timestamp);
+CREATE INDEX IF NOT EXISTS images_barcode ON images (barcode, timestamp);
+CREATE INDEX IF NOT EXISTS images_snapshot ON images (snapshot);
+CREATE INDEX IF NOT EXISTS images_timestamp ON images (timestamp);
+CREATE INDEX IF NOT EXISTS images_camera ON images (imgtype, camera, timestamp);
+"""
+# Tables whose stored records can be replaced (snapshots that were incomplete when they were synced)
+UPDATABLE = ("environment",)
+
+
+def is_sqlite(dataset_dir):
+    """Check whether a dataset stores its metadata in a SQLite database.
+
+    Keyword arguments:
+    dataset_dir = Dataset directory path.
+
+    Returns:
+    sqlite = True if the dataset has a SQLite metadata database.
+
+    :param dataset_dir: str
+    :return sqlite: bool
+    """
+    return os.path.exists(os.path.join(dataset_dir, SQLITE_FILE))
+
+
+def init_sqlite(dataset_dir, dataset):
+    """Initialize an empty SQLite metadata database.
+
+    The environment and image records are stored as JSON with indexed barcode, snapshot, timestamp and
+    imgtype/camera columns, so selections do not need to load the whole dataset.
+
+    Keyword arguments:
+    dataset_dir = Dataset directory path.
+    dataset = Dataset section of the metadata.
+
+    :param dataset_dir: str
+    :param dataset: dict
+    """
+    with _connect(dataset_dir=dataset_dir) as conn:
+        conn.executescript(SCHEMA)
+        conn.execute("INSERT OR IGNORE INTO dataset (id, metadata) VALUES (0, ?)", [json.dumps(dataset)])
+    conn.close()
+
+
+def load_sqlite(dataset_dir):
+    """Load the dataset metadata from the SQLite metadata database.
+
+    Keyword arguments:
+    dataset_dir = Dataset directory path.
+
+    Returns:
+    meta = Dataset metadata.
+
+    :param dataset_dir: str
+    :return meta: dict
+    """
+    conn = _connect(dataset_dir=dataset_dir)
+    meta = {"dataset": json.loads(conn.execute("SELECT metadata FROM dataset").fetchone()[0])}
+    for table in TABLES:
+        # Records are loaded in the order they were added
+        meta[table] = {name: json.loads(record) for name, record in
+                       conn.execute(f"SELECT name, record FROM {table} ORDER BY rowid")}
+    conn.close()
+    return meta
+
+
+def load_sqlite_dataset(dataset_dir):
+    """Load the dataset section from the SQLite metadata database, without the records.
+
+    Keyword arguments:
+    dataset_dir = Dataset directory path.
+
+    Returns:
+    dataset = Dataset section of the metadata.
+
+    :param dataset_dir: str
+    :return dataset: dict
+    """
+    conn = _connect(dataset_dir=dataset_dir)
+    dataset = json.loads(conn.execute("SELECT metadata FROM dataset").fetchone()[0])
+    conn.close()
+    return dataset
+
+
+def save_sqlite(dataset_dir, metadata):
+    """Save the dataset metadata to the SQLite metadata database.
+
+    Records are only added to the metadata (see merge_records), so the records loaded from the database come first
+    and only the records after them are inserted. Environment records that changed (snapshots that were incomplete)
+    are updated in place. If the metadata does not start with the stored records the table is rewritten.
+
+    Keyword arguments:
+    dataset_dir = Dataset directory path.
+    metadata = Dataset metadata.
+
+    :param dataset_dir: str
+    :param metadata: dict
+    """
+    conn = _connect(dataset_dir=dataset_dir)
+    with conn:
+        conn.execute("UPDATE dataset SET metadata = ? WHERE id = 0", [json.dumps(metadata["dataset"])])
+        for table, columns in TABLES.items():
+            names = list(metadata[table])
+            count = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            last = conn.execute(f"SELECT name FROM {table} ORDER BY rowid DESC LIMIT 1").fetchone()
+            if count > 0 and (len(names) < count or names[count - 1] != last[0]):
+                conn.execute(f"DELETE FROM {table}")
+                count = 0
+            elif table in UPDATABLE:
+                # Update the stored records that changed, keeping their position
+                changed = [name for name, record in conn.execute(f"SELECT name, record FROM {table}")
+                           if name in metadata[table] and json.loads(record) != metadata[table][name]]
+                conn.executemany(f"UPDATE {table} SET {', '.join(column + ' = ?' for column in columns)}, record = ? "
+                                 f"WHERE name = ?",
+                                 ([metadata[table][name].get(column) for column in columns] +
+                                  [json.dumps(metadata[table][name], default=json_default), name] for name in changed))
+            conn.executemany(f"INSERT OR REPLACE INTO {table} (name, {', '.join(columns)}, record) "
+                             f"VALUES ({', '.join('?' * (len(columns) + 2))})",
+                             ([name] + [metadata[table][name].get(column) for column in columns] +
+                              [json.dumps(metadata[table][name], default=json_default)] for name in names[count:]))
+    conn.close()
+
+
+def iter_sqlite_records(dataset_dir, table):
+    """Stream the records of a table from the SQLite metadata database.
+
+    Keyword arguments:
+    dataset_dir = Dataset directory path.
+    table = Record table (environment or images).
+
+    Returns:
+    records = Iterator of (name, record) tuples in the order they were added.
+
+    :param dataset_dir: str
+    :param table: str
+    :return records: iterator
+    """
+    if table not in TABLES:
+        raise ValueError(f"Unknown metadata table {table}, use environment or images.")
+    conn = _connect(dataset_dir=dataset_dir)
+    try:
+        for name, record in conn.execute(f"SELECT name, record FROM {table} ORDER BY rowid"):
+            yield name, json.loads(record)
+    finally:
+        conn.close()
+
+
+def select_images(dataset_dir, barcode=None, snapshot=None, imgtype=None, camera=None, start=None, end=None):
+    """Select image records from the SQLite metadata database with indexed lookups.
+
+    Keyword arguments:
+    dataset_dir = Dataset directory path.
+    barcode = Plant barcode (default = None, all barcodes).
+    snapshot = Snapshot name, e.g. snapshot1 (default = None, all snapshots).
+    imgtype = Image type, e.g. VIS or NIR (default = None, all image types).
+    camera = Camera view, e.g. SV or TV (default = None, all cameras).
+    start = Earliest UTC timestamp or date (YYYY-MM-DD), inclusive (default = None).
+    end = Latest UTC timestamp or date (YYYY-MM-DD), exclusive (default = None).
+
+    Returns:
+    images = Image records, ordered by timestamp.
+
+    :param dataset_dir: str
+    :param barcode: str
+    :param snapshot: str
+    :param imgtype: str
+    :param camera: str
+    :param start: str
+    :param end: str
+    :return images: dict
+    """
+    filters = {"barcode": barcode, "snapshot": snapshot, "imgtype": imgtype, "camera": camera}
+    return _select(dataset_dir=dataset_dir, table="images", filters=filters, start=start, end=end)
+
+
+def select_snapshots(dataset_dir, barcode=None, start=None, end=None):
+    """Select environment (snapshot) records from the SQLite metadata database with indexed lookups.
+
+    Keyword arguments:
+    dataset_dir = Dataset directory path.
+    barcode = Plant barcode (default = None, all barcodes).
+    start = Earliest UTC timestamp or date (YYYY-MM-DD), inclusive (default = None).
+    end = Latest UTC timestamp or date (YYYY-MM-DD), exclusive (default = None).
+
+    Returns:
+    environment = Environment records, ordered by timestamp.
+
+    :param dataset_dir: str
+    :param barcode: str
+    :param start: str
+    :param end: str
+    :return environment: dict
+    """
+    return _select(dataset_dir=dataset_dir, table="environment", filters={"barcode": barcode}, start=start, end=end)
+
+
+def sqlite_summary(dataset_dir):
+    """Summarize the SQLite metadata database without loading the records.
+
+    Keyword arguments:
+    dataset_dir = Dataset directory path.
+
+    Returns:
+    summary = Snapshot and image counts and the first and last snapshot timestamps.
+
+    :param dataset_dir: str
+    :return summary: dict
+    """
+    conn = _connect(dataset_dir=dataset_dir)
+    snapshots, first, last = conn.execute("SELECT COUNT(*), MIN(timestamp), MAX(timestamp) FROM environment").fetchone()
+    images = conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+    conn.close()
+    return {"snapshots": snapshots, "images": images, "first_timestamp": first, "last_timestamp": last}
+
+
+def _connect(dataset_dir):
+    """Open a connection to the SQLite metadata database."""
+    return sqlite3.connect(os.path.join(dataset_dir, SQLITE_FILE))
+
+
+def _select(dataset_dir, table, filters, start, end):
+    """Select the records of a table that match the filters and timestamp range."""
+    clauses = []
+    params = []
+    for column, value in filters.items():
+        if value is not None:
+            clauses.append(f"{column} = ?")
+            params.append(value)
+    if start is not None:
+        clauses.append("timestamp >= ?")
+        params.append(start)
+    if end is not None:
+        clauses.append("timestamp < ?")
+        params.append(end)
+    query = f"SELECT name, record FROM {table}"
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    conn = _connect(dataset_dir=dataset_dir)
+    records = {name: json.loads(record) for name, record in conn.execute(query + " ORDER BY timestamp", params)}
+    conn.close()
+    return records
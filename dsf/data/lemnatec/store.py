@@ -0,0 +1,269 @@
+import os
+import json
+from dsf.data.lemnatec.records import json_default
+
+
+# Sharded metadata store directory and manifest filenames
+STORE_DIR = "metadata"
+MANIFEST_FILE = "manifest.json"
+# Metadata sections stored as JSON-lines shards
+SECTIONS = ("environment", "images")
+# Partition for records without a timestamp
+UNDATED = "undated"
+# Sections whose stored records can be replaced (snapshots that were incomplete when they were synced)
+UPDATABLE = ("environment",)
+# Start of the shard lines, before the record name
+NAME_PREFIX = '{"name": '
+_decoder = json.JSONDecoder()
+
+
+def is_sharded(dataset_dir):
+    """Check whether a dataset uses the sharded metadata store.
+
+    Keyword arguments:
+    dataset_dir = Dataset directory path.
+
+    Returns:
+    sharded = True if the dataset has a sharded metadata store manifest.
+
+    :param dataset_dir: str
+    :return sharded: bool
+    """
+    return os.path.exists(os.path.join(dataset_dir, STORE_DIR, MANIFEST_FILE))
+
+
+def init_store(dataset_dir, dataset):
+    """Initialize an empty sharded metadata store.
+
+    The store keeps the dataset section in a small manifest and the environment and image records in per-day
+    JSON-lines shards (metadata/<section>/<YYYY-MM-DD>.jsonl), so updates only append new records.
+
+    Keyword arguments:
+    dataset_dir = Dataset directory path.
+    dataset = Dataset section of the metadata.
+
+    :param dataset_dir: str
+    :param dataset: dict
+    """
+    for section in SECTIONS:
+        os.makedirs(os.path.join(dataset_dir, STORE_DIR, section), exist_ok=True)
+    if not is_sharded(dataset_dir=dataset_dir):
+        manifest = {
+            "dataset": dataset,
+            "sections": {section: {"count": 0, "shards": {}} for section in SECTIONS}
+        }
+        _write_manifest(dataset_dir=dataset_dir, manifest=manifest)
+
+
+def load_manifest(dataset_dir):
+    """Load the sharded metadata store manifest.
+
+    Keyword arguments:
+    dataset_dir = Dataset directory path.
+
+    Returns:
+    manifest = Dataset section and the record count of each section and shard.
+
+    :param dataset_dir: str
+    :return manifest: dict
+    """
+    with open(os.path.join(dataset_dir, STORE_DIR, MANIFEST_FILE), "r") as fp:
+        return json.load(fp)
+
+
+def read_records(dataset_dir, section, partitions=None):
+    """Stream the records of a metadata section from its shards.
+
+    Replaced environment records appear more than once in their shard, only the last copy is returned.
+
+    Keyword arguments:
+    dataset_dir = Dataset directory path.
+    section = Metadata section (environment or images).
+    partitions = Dates (YYYY-MM-DD) of the shards to read (default = None, all shards).
+
+    Returns:
+    records = Iterator of (name, record) tuples.
+
+    :param dataset_dir: str
+    :param section: str
+    :param partitions: list
+    :return records: iterator
+    """
+    manifest = load_manifest(dataset_dir=dataset_dir)
+    shards = manifest["sections"][section]["shards"]
+    for partition in sorted(shards if partitions is None else set(partitions) & set(shards)):
+        with open(_shard_file(dataset_dir=dataset_dir, section=section, partition=partition), "r") as fp:
+            entries = _read_shard(fp=fp)
+            if section in UPDATABLE:
+                # Keep the last copy of replaced records, one shard (day) of records is held in memory
+                entries = dict(entries).items()
+            yield from entries
+
+
+def load_store(dataset_dir, partitions=None):
+    """Load the dataset metadata from the sharded metadata store.
+
+    Keyword arguments:
+    dataset_dir = Dataset directory path.
+    partitions = Dates (YYYY-MM-DD) of the shards to load (default = None, all shards).
+
+    Returns:
+    meta = Dataset metadata.
+
+    :param dataset_dir: str
+    :param partitions: list
+    :return meta: dict
+    """
+    meta = {"dataset": load_manifest(dataset_dir=dataset_dir)["dataset"]}
+    for section in SECTIONS:
+        meta[section] = dict(read_records(dataset_dir=dataset_dir, section=section, partitions=partitions))
+    return meta
+
+
+def save_store(dataset_dir, metadata):
+    """Append the new metadata records to the sharded metadata store.
+
+    Records are only added to the metadata (see merge_records), so the records that are not in the shards yet are new,
+    whatever their order. Environment records that changed are appended again, the last copy replaces the stored one.
+    If stored records were removed from the metadata the section is rewritten.
+
+    Keyword arguments:
+    dataset_dir = Dataset directory path.
+    metadata = Dataset metadata.
+
+    :param dataset_dir: str
+    :param metadata: dict
+    """
+    manifest = load_manifest(dataset_dir=dataset_dir)
+    manifest["dataset"] = metadata["dataset"]
+    for section in SECTIONS:
+        stored = manifest["sections"][section]
+        records = metadata[section]
+        if section in UPDATABLE:
+            # Compare the records of small sections so replaced records are saved too
+            stored_records = dict(read_records(dataset_dir=dataset_dir, section=section))
+            names = [name for name in records if records[name] != stored_records.get(name)]
+        else:
+            stored_records = _stored_names(dataset_dir=dataset_dir, section=section, shards=stored["shards"])
+            names = [name for name in records if name not in stored_records]
+        if all(name in records for name in stored_records):
+            _append_section(dataset_dir=dataset_dir, section=section, records=records, names=names,
+                            shards=stored["shards"])
+        else:
+            stored["shards"] = _rewrite_section(dataset_dir=dataset_dir, section=section, records=records)
+        stored.pop("last", None)
+        stored["count"] = len(records)
+    # The manifest is replaced after the shards are written so it never counts missing records
+    _write_manifest(dataset_dir=dataset_dir, manifest=manifest)
+
+
+def atomic_write(filename, data):
+    """Replace a file atomically, so a crash leaves either the old or the new file.
+
+    The data is written to a temporary file that is flushed to disk before it is renamed over the file.
+
+    Keyword arguments:
+    filename = File path.
+    data = File contents.
+
+    :param filename: str
+    :param data: bytes
+    """
+    tmp_file = filename + ".tmp"
+    with open(tmp_file, "wb") as fp:
+        fp.write(data)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_file, filename)
+    # Persist the rename in the directory
+    dir_fd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def _partition(record):
+    """Get the shard partition (UTC date) of a record."""
+    timestamp = record.get("timestamp")
+    return timestamp[:10] if timestamp else UNDATED
+
+
+def _shard_file(dataset_dir, section, partition):
+    """Get the path of a shard file."""
+    return os.path.join(dataset_dir, STORE_DIR, section, f"{partition}.jsonl")
+
+
+def _read_shard(fp):
+    """Stream the (name, record) entries of a shard file."""
+    for line in fp:
+        # Skip partially written records (e.g. after a crash)
+        if not line.endswith("\n"):
+            continue
+        entry = json.loads(line)
+        yield entry["name"], entry["record"]
+
+
+def _stored_names(dataset_dir, section, shards):
+    """Read the names of the records stored in the shards of a section."""
+    names = set()
+    for partition in shards:
+        with open(_shard_file(dataset_dir=dataset_dir, section=section, partition=partition), "r") as fp:
+            for line in fp:
+                # Skip partially written records (e.g. after a crash)
+                if not line.endswith("\n"):
+                    continue
+                # Records are written as {"name": ..., "record": ...}, so only the name needs to be decoded
+                if line.startswith(NAME_PREFIX):
+                    names.add(_decoder.raw_decode(line, len(NAME_PREFIX))[0])
+                else:
+                    names.add(json.loads(line)["name"])
+    return names
+
+
+def _group_records(records, names):
+    """Group the JSON lines of records by partition."""
+    groups = {}
+    for name in names:
+        record = records[name]
+        line = json.dumps({"name": name, "record": record}, default=json_default) + "\n"
+        groups.setdefault(_partition(record), []).append(line)
+    return groups
+
+
+def _append_section(dataset_dir, section, records, names, shards):
+    """Append records to the shards of a section and update the shard record counts."""
+    for partition, lines in _group_records(records=records, names=names).items():
+        with open(_shard_file(dataset_dir=dataset_dir, section=section, partition=partition), "ab+") as fp:
+            # Finish a record that was partially written (e.g. after a crash) so it does not swallow the next one
+            if fp.tell() > 0:
+                fp.seek(-1, os.SEEK_END)
+                if fp.read(1) != b"\n":
+                    fp.write(b"\n")
+            fp.write("".join(lines).encode("utf-8"))
+            # The records must be on disk before the manifest counts them
+            fp.flush()
+            os.fsync(fp.fileno())
+        shards[partition] = shards.get(partition, 0) + len(lines)
+
+
+def _rewrite_section(dataset_dir, section, records):
+    """Replace all the shards of a section, returning the shard record counts."""
+    section_dir = os.path.join(dataset_dir, STORE_DIR, section)
+    os.makedirs(section_dir, exist_ok=True)
+    shards = {}
+    for partition, lines in _group_records(records=records, names=records).items():
+        shard_file = _shard_file(dataset_dir=dataset_dir, section=section, partition=partition)
+        atomic_write(filename=shard_file, data="".join(lines).encode("utf-8"))
+        shards[partition] = len(lines)
+    # Remove shards that no longer have records
+    for filename in os.listdir(section_dir):
+        if filename.endswith(".jsonl") and filename[:-len(".jsonl")] not in shards:
+            os.remove(os.path.join(section_dir, filename))
+    return shards
+
+
+def _write_manifest(dataset_dir, manifest):
+    """Atomically replace the store manifest."""
+    atomic_write(filename=os.path.join(dataset_dir, STORE_DIR, MANIFEST_FILE),
+                 data=json.dumps(manifest, indent=4).encode("utf-8"))
@@ -0,0 +1,122 @@
+import os
+import json
+from dsf.data.lemnatec.store import STORE_DIR
+from dsf.data.lemnatec.store import MANIFEST_FILE
+from dsf.data.lemnatec.store import atomic_write
+from dsf.data.lemnatec.sqlite import SQLITE_FILE
+from dsf.data.lemnatec.dataset import JOURNAL_FILE
+from dsf.data.lemnatec.dataset import open_dataset
+
+
+# Dataset summary filename
+SUMMARY_FILE = "summary.json"
+# Summary format version, summaries written with another version are recomputed
+SUMMARY_VERSION = 1
+# Image count key for records without an image type or camera
+UNKNOWN = "unknown"
+# Metadata files of each layout, the summary is recomputed when one of them changes
+LAYOUT_FILES = {
+    "json": "metadata.json",
+    "sharded": os.path.join(STORE_DIR, MANIFEST_FILE),
+    "sqlite": SQLITE_FILE
+}
+
+
+def dataset_summary(dataset_dir, refresh=False):
+    """Get the dataset summary, from the cached summary file if the dataset has not changed since it was written.
+
+    The summary file is keyed by the size, modification time and inode of the metadata and the image transfer
+    journal, so it is recomputed after the metadata is saved or images are downloaded. Image files that are changed
+    or deleted without a journal write (e.g. transfers without the journal) are not detected, the bytes on disk are
+    then stale until the summary is refreshed. If the dataset directory is not writable the summary is computed but
+    not cached.
+
+    Keyword arguments:
+    dataset_dir = Dataset directory path.
+    refresh = Recompute the summary even if the cached summary is current (default = False).
+
+    Returns:
+    summary = Snapshot and image counts, first and last snapshot timestamps, image counts by image type and camera
+              and the dataset size in bytes.
+
+    :param dataset_dir: str
+    :param refresh: bool
+    :return summary: dict
+    """
+    dataset = open_dataset(dataset_dir=dataset_dir)
+    key = _summary_key(dataset_dir=dataset_dir, layout=dataset.layout)
+    summary_file = os.path.join(dataset_dir, SUMMARY_FILE)
+    if not refresh and os.path.exists(summary_file):
+        with open(summary_file, "r") as fp:
+            try:
+                summary = json.load(fp)
+            except json.JSONDecodeError:
+                summary = {}
+        if summary.get("key") == key:
+            return summary
+    summary = _compute_summary(dataset=dataset)
+    summary["key"] = key
+    try:
+        atomic_write(filename=summary_file, data=json.dumps(summary, indent=4).encode("utf-8"))
+    except OSError:
+        # Read-only datasets (e.g. read-only mounts or other users' directories) are summarized without the cache
+        pass
+    return summary
+
+
+def _summary_key(dataset_dir, layout):
+    """Build the cache key of the summary from the metadata and journal file stats."""
+    key = {"version": SUMMARY_VERSION, "layout": layout}
+    for filename in [LAYOUT_FILES[layout], JOURNAL_FILE]:
+        try:
+            stat = os.stat(os.path.join(dataset_dir, filename))
+        except FileNotFoundError:
+            key[filename] = None
+        else:
+            key[filename] = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+    return key
+
+
+def _compute_summary(dataset):
+    """Summarize the dataset metadata in one pass over each section and the dataset directory."""
+    snapshots = 0
+    first = None
+    last = None
+    for _, record in dataset.records(section="environment"):
+        snapshots += 1
+        # UTC timestamps have a fixed width format, so they sort as strings
+        timestamp = record["timestamp"]
+        if first is None or timestamp < first:
+            first = timestamp
+        if last is None or timestamp > last:
+            last = timestamp
+    images = 0
+    cameras = {}
+    for _, record in dataset.records(section="images"):
+        images += 1
+        imgtype = cameras.setdefault(record.get("imgtype") or UNKNOWN, {})
+        camera = record.get("camera") or UNKNOWN
+        imgtype[camera] = imgtype.get(camera, 0) + 1
+    return {
+        "snapshots": snapshots,
+        "images": images,
+        "first_timestamp": first,
+        "last_timestamp": last,
+        "cameras": cameras,
+        "bytes": _disk_usage(dataset_dir=dataset.dataset_dir)
+    }
+
+
+def _disk_usage(dataset_dir):
+    """Sum the size of the dataset files with a single directory sweep, excluding the summary file."""
+    total = 0
+    stack = [dataset_dir]
+    while stack:
+        directory = stack.pop()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name != SUMMARY_FILE or directory != dataset_dir:
+                    total += entry.stat(follow_symlinks=False).st_size
+    return total
@@ -1,84 +1,623 @@
 import os
+import io
+import errno
 import zipfile
+import queue
+import threading
+import multiprocessing
+import time
+from dataclasses import dataclass
+from dataclasses import field
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import cv2
+import paramiko
 from tqdm import tqdm
 import sys
 from datetime import datetime
+from dsf.data.lemnatec.connections import open_sftp_connection
+from dsf.data.lemnatec.connections import close_sftp_connection
+from dsf.data.lemnatec.connections import sftp_alive
+from dsf.data.lemnatec.dataset import scan_dataset
+from dsf.data.lemnatec.dataset import Inventory
+from dsf.data.lemnatec.dataset import Journal
+from dsf.data.lemnatec.dataset import load_journal
 
 
-def transfer_images(metadata, sftp, dataset_dir, config):
+@dataclass
+class _Transfer:
+    """Settings and shared state for a transfer_images run."""
+    dataset_dir: str
+    config: object
+    inventory: object
+    journal: object = None
+    pipeline: object = None
+    in_memory: bool = False
+    remote_index: dict = None
+    retries: int = 3
+    backoff: float = 1.0
+    failed: list = field(default_factory=list)
+    pool: object = None
+
+
+class _Session:
+    """SFTP connection that is reopened when its SSH transport drops."""
+    def __init__(self, sftp, config, owned=False):
+        self.sftp = sftp
+        self.config = config
+        # Only close connections that were opened here
+        self.owned = owned
+
+    def alive(self):
+        return sftp_alive(sftp=self.sftp)
+
+    def reconnect(self):
+        if self.owned:
+            try:
+                close_sftp_connection(sftp=self.sftp)
+            except (OSError, EOFError, paramiko.SSHException):
+                pass
+        self.sftp = open_sftp_connection(config=self.config)
+        self.owned = True
+
+    def close(self):
+        if self.owned:
+            close_sftp_connection(sftp=self.sftp)
+
+
+def transfer_images(metadata, sftp, dataset_dir, config, workers=1, processes=0, queue_size=None, in_memory=False,
+                    index_remote=False, inventory=None, journal=True, retries=3, backoff=1.0, pool=None,
+                    checkpoint_interval=30.0, rescan=False):
     """Copy images from the database server to the dataset directory.
 
     Keyword arguments:
     metadata = Dataset metadata.
-    sftp = paramiko SFTP connection object.
+    sftp = paramiko SFTP connection object, or None when there is more than one worker.
     dataset_dir = Dataset directory path.
     config = Instance of the class Config.
+    workers = Number of concurrent download workers (default = 1). Each worker opens its own SFTP connection.
+    processes = Number of processes used to convert raw images to PNG (default = 0, convert after each download).
+    queue_size = Maximum number of downloaded images waiting for conversion (default = 2 * processes).
+    in_memory = Download raw images into memory instead of a temporary blob file (default = False). The blob is only
+                written to the dataset directory if the conversion fails.
+    index_remote = List the remote blob directories once before transferring (default = False). Missing blobs are
+                   skipped without a request to the server and downloaded blob sizes are validated. Directories that
+                   cannot be listed after the retries are transferred without the index.
+    inventory = Dataset inventory from scan_dataset (default = None, scan the dataset directory unless a transfer
+                journal exists).
+    journal = Record image transfer states in the dataset transfer journal and resume from it (default = True).
+    retries = Number of times a failed download is retried (default = 3). The SFTP connection is reopened if it
+              dropped and images that still fail are retried once more at the end of the run.
+    backoff = Delay in seconds before the first retry, doubled for each following retry (default = 1.0).
+    pool = Connection pool that the download workers lease their SFTP connections from (default = None, each worker
+           opens its own connection).
+    checkpoint_interval = Seconds between checkpoints of the transfer journal to disk (default = 30.0). Each checkpoint
+                          only writes the image states recorded since the previous one.
+    rescan = Scan the dataset directory and start a new transfer journal from the images found, instead of resuming
+             from the journal (default = False). Images that were deleted after they were written are transferred
+             again.
 
     :param metadata: dict
     :param sftp: paramiko.sftp_client.SFTPClient
     :param dataset_dir: str
     :param config: dsf.data.lemnatec.config.Config
+    :param workers: int
+    :param processes: int
+    :param queue_size: int
+    :param in_memory: bool
+    :param index_remote: bool
+    :param inventory: dsf.data.lemnatec.dataset.Inventory
+    :param journal: bool
+    :param retries: int
+    :param backoff: float
+    :param pool: dsf.data.lemnatec.connections.ConnectionPool
+    :param checkpoint_interval: float
+    :param rescan: bool
+    """
+    # Image states from previous runs
+    states = load_journal(dataset_dir=dataset_dir) if journal and not rescan else None
+    if inventory is None:
+        # Replaying the journal replaces scanning the dataset directory
+        inventory = Inventory(dataset_dir=dataset_dir) if states is not None else scan_dataset(dataset_dir=dataset_dir)
+    transfer = _Transfer(dataset_dir=dataset_dir, config=config, inventory=inventory, in_memory=in_memory,
+                         retries=retries, backoff=backoff, pool=pool)
+    if journal:
+        os.makedirs(dataset_dir, exist_ok=True)
+        transfer.journal = Journal(dataset_dir=dataset_dir, checkpoint_interval=checkpoint_interval, reset=rescan)
+        if states is None:
+            # Start the journal from the images already in the dataset
+            states = {}
+            for image in metadata["images"]:
+                if inventory.exists(image):
+                    transfer.journal.record(image=image, state="written")
+                    states[image] = "written"
+    # Images that have not been transferred yet
+    pending = _pending_images(metadata=metadata, inventory=inventory, states=states or {})
+    session = _Session(sftp=sftp, config=config)
+    if index_remote:
+        dates = {_remote_blob(img_metadata=metadata["images"][image])[0] for image in pending}
+        if sftp is None:
+            # Open a connection for the listing when only the workers have connections
+            index_session = _open_session(transfer=transfer)
+            try:
+                transfer.remote_index = _index_remote_blobs(session=index_session, dates=dates, transfer=transfer)
+            finally:
+                _close_session(transfer=transfer, session=index_session)
+        else:
+            transfer.remote_index = _index_remote_blobs(session=session, dates=dates, transfer=transfer)
+        total_bytes = 0
+        for image in pending:
+            date, blob = _remote_blob(img_metadata=metadata["images"][image])
+            if blob in transfer.remote_index.get(date, {}):
+                total_bytes += transfer.remote_index[date][blob][0]
+        print(f"Transferring {len(pending)} images ({total_bytes} bytes).")
+    # Run the CPU-bound conversion stages in a process pool so they overlap with downloads
+    if processes > 0:
+        transfer.pipeline = _ConversionPipeline(processes=processes, queue_size=queue_size or 2 * processes)
+    try:
+        _run_transfers(metadata=metadata, images=pending, session=session, transfer=transfer, workers=workers)
+        if transfer.failed:
+            # Give images that failed with network errors one more try
+            print(f"Retrying {len(transfer.failed)} failed image transfers.", file=sys.stderr)
+            failed = transfer.failed
+            transfer.failed = []
+            _run_transfers(metadata=metadata, images=failed, session=session, transfer=transfer, workers=workers)
+            for image in transfer.failed:
+                print(f"Warning: the transfer of image {image} failed.", file=sys.stderr)
+    finally:
+        session.close()
+        if transfer.pipeline is not None:
+            transfer.pipeline.close()
+        if transfer.journal is not None:
+            transfer.journal.close()
+
+
+def _pending_images(metadata, inventory, states):
+    """List the images that have not been written to the dataset directory.
+
+    Keyword arguments:
+    metadata = Dataset metadata.
+    inventory = Dataset inventory.
+    states = Image transfer states from the journal.
+
+    Returns:
+    pending = Image relative paths.
+
+    :param metadata: dict
+    :param inventory: dsf.data.lemnatec.dataset.Inventory
+    :param states: dict
+    :return pending: list
+    """
+    return [image for image in metadata["images"] if states.get(image) != "written" and not inventory.exists(image)]
+
+
+def _remote_blob(img_metadata):
+    """Get the remote directory (snapshot date) and filename of a raw image.
+
+    Keyword arguments:
+    img_metadata = Image metadata.
+
+    Returns:
+    snapshot_date = Snapshot date (local time) directory.
+    raw_img = Raw image filename.
+
+    :param img_metadata: dict
+    :return snapshot_date: str
+    :return raw_img: str
+    """
+    snapshot_date = datetime.strptime(img_metadata["local_time"], "%Y-%m-%dT%H:%M:%S.%f%z").strftime("%Y-%m-%d")
+    return snapshot_date, f"blob{img_metadata['raw_image_oid']}"
+
+
+def _index_remote_blobs(session, dates, transfer):
+    """List the raw image blobs available on the database server, retrying listing errors with exponential backoff.
+
+    Dates that cannot be listed are left out of the index, so their images are downloaded without an index lookup.
+
+    Keyword arguments:
+    session = SFTP connection.
+    dates = Snapshot dates (remote directory names).
+    transfer = Transfer settings.
+
+    Returns:
+    index = Dictionary of blob (size, mtime) by date and filename.
+
+    :param session: dsf.data.lemnatec.transfers._Session
+    :param dates: set
+    :param transfer: dsf.data.lemnatec.transfers._Transfer
+    :return index: dict
+    """
+    index = {}
+    for date in dates:
+        remote_dir = os.path.join("/data/pgftp", transfer.config.database, date)
+        for attempt in range(transfer.retries + 1):
+            try:
+                index[date] = {attr.filename: (attr.st_size, attr.st_mtime)
+                               for attr in session.sftp.listdir_attr(remote_dir)}
+                break
+            except (OSError, EOFError, paramiko.SSHException) as e:
+                if isinstance(e, OSError) and e.errno == errno.ENOENT:
+                    # The date has no blobs on the server
+                    index[date] = {}
+                    break
+                error = e
+            if attempt < transfer.retries:
+                time.sleep(transfer.backoff * 2 ** attempt)
+                try:
+                    if not session.alive():
+                        session.reconnect()
+                except (OSError, EOFError, paramiko.SSHException) as e:
+                    error = e
+        else:
+            print(f"Warning: cannot list the blobs in {remote_dir}, its images are transferred without the index: "
+                  f"{error}", file=sys.stderr)
+    return index
+
+
+def _run_transfers(metadata, images, session, transfer, workers):
+    """Download images using one or more SFTP connections.
+
+    Keyword arguments:
+    metadata = Dataset metadata.
+    images = Image relative paths to transfer.
+    session = SFTP connection used when there is a single worker.
+    transfer = Transfer settings.
+    workers = Number of concurrent download workers.
+
+    :param metadata: dict
+    :param images: list
+    :param session: dsf.data.lemnatec.transfers._Session
+    :param transfer: dsf.data.lemnatec.transfers._Transfer
+    :param workers: int
     """
-    for image in tqdm(metadata["images"].keys()):
-        # Spli the filename from the relative path:
-        # rel_path = barcode/date/snapshotID
-        rel_path, filename = os.path.split(image)
-        # snapshot_dir = dataset/date/snapshotID
-        snapshot_dir = os.path.join(dataset_dir, rel_path)
-        # snapshot date
-        snapshot_date = datetime.strptime(metadata["images"][image]["local_time"],
-                                          "%Y-%m-%dT%H:%M:%S.%f%z").strftime("%Y-%m-%d")
-        # Make the snapshot directory if it does not exist
-        os.makedirs(snapshot_dir, exist_ok=True)
-        # Image local path, dataset/barcode/date/snapshotID/filename
-        imgpath = os.path.join(snapshot_dir, filename)
-        # If the image does not exist we will transfer the raw image
-        if not os.path.exists(imgpath):
-            # Raw image filename = blobID
-            raw_img = f"blob{metadata['images'][image]['raw_image_oid']}"
-            # Local path to the raw image = dataset/date/snapshotID/blobID
-            local_path = os.path.join(snapshot_dir, raw_img)
-            # Remote path to the raw image = /data/pgftp/database/date/blobID
-            remote_path = os.path.join("/data/pgftp", config.database, snapshot_date, raw_img)
-            _transfer_raw_image(sftp=sftp, remote_path=remote_path, local_path=local_path)
-            img_metadata = metadata["images"][image]
-            img = _convert_raw_to_png(raw=local_path, filename=image, height=img_metadata["height"],
-                                      width=img_metadata["width"],
-                                      dtype=config.dataformat[img_metadata["dataformat"]]["datatype"],
-                                      imgtype=config.dataformat[img_metadata["dataformat"]]["imgtype"],
-                                      bayertype=img_metadata["dataformat"],
-                                      precision=config.dataformat[img_metadata["dataformat"]]["bit-precision"],
-                                      flip=img_metadata["rotate_flip_type"])
-            if img is not False:
-                cv2.imwrite(imgpath, img)
-                os.remove(local_path)
-
-
-def _transfer_raw_image(sftp, remote_path, local_path):
+    if workers > 1:
+        # Work queue of image records, one stop signal (None) per worker
+        work = queue.Queue()
+        for image in images:
+            work.put((image, metadata["images"][image]))
+        for _ in range(workers):
+            work.put(None)
+        with tqdm(total=len(images)) as progress:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(_download_worker, work=work, transfer=transfer, progress=progress)
+                           for _ in range(workers)]
+                for future in futures:
+                    # Re-raise any errors from the workers
+                    future.result()
+    else:
+        for image in tqdm(images):
+            _transfer_image(image=image, img_metadata=metadata["images"][image], session=session, transfer=transfer)
+
+
+def _download_worker(work, transfer, progress):
+    """Transfer images from the work queue over a dedicated SFTP connection.
+
+    Keyword arguments:
+    work = Queue of (image, image metadata) tuples, terminated by None.
+    transfer = Transfer settings.
+    progress = Shared progress bar.
+
+    :param work: queue.Queue
+    :param transfer: dsf.data.lemnatec.transfers._Transfer
+    :param progress: tqdm.tqdm
+    """
+    session = _open_session(transfer=transfer)
+    try:
+        while True:
+            item = work.get()
+            if item is None:
+                break
+            image, img_metadata = item
+            _transfer_image(image=image, img_metadata=img_metadata, session=session, transfer=transfer)
+            progress.update()
+    finally:
+        _close_session(transfer=transfer, session=session)
+
+
+def _open_session(transfer):
+    """Lease an SFTP connection from the pool, or open one if there is no pool."""
+    if transfer.pool is not None:
+        return _Session(sftp=transfer.pool.acquire_sftp(), config=transfer.config)
+    return _Session(sftp=open_sftp_connection(config=transfer.config), config=transfer.config, owned=True)
+
+
+def _close_session(transfer, session):
+    """Return an SFTP connection to the pool, or close it if there is no pool."""
+    if transfer.pool is not None:
+        # Pooled connections, including reopened ones, go back to the pool
+        transfer.pool.release_sftp(sftp=session.sftp)
+    else:
+        session.close()
+
+
+def _transfer_image(image, img_metadata, session, transfer):
+    """Transfer a single image and convert it to PNG format.
+
+    Keyword arguments:
+    image = Image relative path (barcode/date/snapshotID/filename).
+    img_metadata = Image metadata.
+    session = SFTP connection.
+    transfer = Transfer settings.
+
+    :param image: str
+    :param img_metadata: dict
+    :param session: dsf.data.lemnatec.transfers._Session
+    :param transfer: dsf.data.lemnatec.transfers._Transfer
+    """
+    config = transfer.config
+    # Spli the filename from the relative path:
+    # rel_path = barcode/date/snapshotID
+    rel_path, filename = os.path.split(image)
+    # snapshot_dir = dataset/date/snapshotID
+    snapshot_dir = os.path.join(transfer.dataset_dir, rel_path)
+    # snapshot date and raw image filename = blobID
+    snapshot_date, raw_img = _remote_blob(img_metadata=img_metadata)
+    # Remote path to the raw image = /data/pgftp/database/date/blobID
+    remote_path = os.path.join("/data/pgftp", config.database, snapshot_date, raw_img)
+    # Expected size of the raw image, if the remote directory was indexed
+    size = None
+    if transfer.remote_index is not None and snapshot_date in transfer.remote_index:
+        if raw_img not in transfer.remote_index[snapshot_date]:
+            print(f"Warning: the raw file {remote_path} containing image {image} does not exist.", file=sys.stderr)
+            _record(transfer=transfer, image=image, state="failed")
+            return
+        size = transfer.remote_index[snapshot_date][raw_img][0]
+    # Make the snapshot directory if it does not exist
+    transfer.inventory.makedirs(rel_path)
+    # Image local path, dataset/barcode/date/snapshotID/filename
+    imgpath = os.path.join(snapshot_dir, filename)
+    # Local path to the raw image = dataset/date/snapshotID/blobID
+    local_path = os.path.join(snapshot_dir, raw_img)
+    raw = _download_raw_image(session=session, image=image, remote_path=remote_path, local_path=local_path,
+                              size=size, transfer=transfer)
+    if raw is None:
+        _record(transfer=transfer, image=image, state="failed")
+        return
+    _record(transfer=transfer, image=image, state="fetched")
+    task = {"raw": raw, "blob": local_path, "image": image, "imgpath": imgpath, "img_metadata": img_metadata,
+            "dataformat": config.dataformat[img_metadata["dataformat"]]}
+    if transfer.pipeline is None:
+        _converted(transfer=transfer, image=image, status=_convert_image(**task))
+    else:
+        transfer.pipeline.submit(callback=lambda status: _converted(transfer=transfer, image=image, status=status),
+                                 **task)
+
+
+def _converted(transfer, image, status):
+    """Record the outcome of an image conversion.
+
+    Keyword arguments:
+    transfer = Transfer settings.
+    image = Image relative path.
+    status = True if the image was written.
+
+    :param transfer: dsf.data.lemnatec.transfers._Transfer
+    :param image: str
+    :param status: bool
+    """
+    if status:
+        transfer.inventory.add(image)
+    _record(transfer=transfer, image=image, state="written" if status else "failed")
+
+
+def _record(transfer, image, state):
+    """Record an image state in the transfer journal, if enabled.
+
+    Keyword arguments:
+    transfer = Transfer settings.
+    image = Image relative path.
+    state = Transfer state (fetched, written, or failed).
+
+    :param transfer: dsf.data.lemnatec.transfers._Transfer
+    :param image: str
+    :param state: str
+    """
+    if transfer.journal is not None:
+        transfer.journal.record(image=image, state=state)
+
+
+class _ConversionPipeline:
+    """Bounded process pool for the CPU stages of the transfer (decode, demosaic/rescale, encode/write).
+
+    Downloaders block in submit when queue_size images are waiting for conversion, which caps memory use.
+    """
+    def __init__(self, processes, queue_size):
+        # Spawn (rather than fork) workers since the parent process runs SSH transport threads
+        self.executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"))
+        self.slots = threading.BoundedSemaphore(queue_size)
+        self.error = None
+
+    def submit(self, callback, **task):
+        self.slots.acquire()
+        future = self.executor.submit(_convert_image, **task)
+        future.add_done_callback(lambda f: self._done(future=f, callback=callback))
+
+    def _done(self, future, callback):
+        self.slots.release()
+        if future.exception() is not None:
+            if self.error is None:
+                self.error = future.exception()
+        else:
+            callback(future.result())
+
+    def close(self):
+        # Wait for the queued conversions to finish
+        self.executor.shutdown(wait=True)
+        if self.error is not None:
+            raise self.error
+
+
+def _convert_image(raw, blob, image, imgpath, img_metadata, dataformat):
+    """Convert a raw image to PNG format and write it to the dataset directory.
+
+    Keyword arguments:
+    raw = raw image file path or raw image data.
+    blob = raw image file path. Removed after a successful conversion, written if in-memory data fails to convert.
+    image = Image relative path (barcode/date/snapshotID/filename).
+    imgpath = Output PNG image path.
+    img_metadata = Image metadata.
+    dataformat = Data format settings for the image (datatype, imgtype, bit-precision).
+
+    Returns:
+    status = True if the image was written.
+
+    :param raw: str or bytes
+    :param blob: str
+    :param image: str
+    :param imgpath: str
+    :param img_metadata: dict
+    :param dataformat: dict
+    :return status: bool
+    """
+    in_memory = isinstance(raw, bytes)
+    img = _convert_raw_to_png(raw=io.BytesIO(raw) if in_memory else raw, filename=image,
+                              height=img_metadata["height"], width=img_metadata["width"],
+                              dtype=dataformat["datatype"], imgtype=dataformat["imgtype"],
+                              bayertype=img_metadata["dataformat"], precision=dataformat["bit-precision"],
+                              flip=img_metadata["rotate_flip_type"])
+    if img is False:
+        if in_memory:
+            # Keep the raw image for inspection
+            with open(blob, "wb") as fp:
+                fp.write(raw)
+            print(f"Warning: the raw data for image {image} was saved to {blob}.", file=sys.stderr)
+        return False
+    # Write the PNG to a temporary file and rename it so that partial images never exist at imgpath
+    _, png = cv2.imencode(".png", img)
+    with open(f"{imgpath}.tmp", "wb") as fp:
+        fp.write(png)
+    os.replace(f"{imgpath}.tmp", imgpath)
+    if not in_memory:
+        os.remove(blob)
+    return True
+
+
+def _download_raw_image(session, image, remote_path, local_path, size, transfer):
+    """Download a raw image, retrying network errors with exponential backoff.
+
+    Keyword arguments:
+    session = SFTP connection.
+    image = Image relative path.
+    remote_path = remote filepath.
+    local_path = local filepath.
+    size = expected file size in bytes, if known.
+    transfer = Transfer settings.
+
+    Returns:
+    raw = raw image data (in memory transfers) or local filepath, None if the transfer failed.
+
+    :param session: dsf.data.lemnatec.transfers._Session
+    :param image: str
+    :param remote_path: str
+    :param local_path: str
+    :param size: int
+    :param transfer: dsf.data.lemnatec.transfers._Transfer
+    :return raw: bytes or str
+    """
+    for attempt in range(transfer.retries + 1):
+        try:
+            if transfer.in_memory:
+                # Keep the raw image in memory, the blob file is only written if the conversion fails
+                return _fetch_raw_image(sftp=session.sftp, remote_path=remote_path, size=size)
+            _transfer_raw_image(sftp=session.sftp, remote_path=remote_path, local_path=local_path, size=size)
+            return local_path
+        except (OSError, EOFError, paramiko.SSHException) as e:
+            if isinstance(e, OSError) and e.errno in (errno.ENOENT, errno.EACCES):
+                # Missing or unreadable files will not succeed on retry
+                print(f"I/O error({e.errno}): {e.strerror}. Offending file: {remote_path}", file=sys.stderr)
+                return None
+            error = e
+        if attempt < transfer.retries:
+            time.sleep(transfer.backoff * 2 ** attempt)
+            try:
+                if not session.alive():
+                    session.reconnect()
+            except (OSError, EOFError, paramiko.SSHException) as e:
+                error = e
+    print(f"Warning: the transfer of {remote_path} failed after {transfer.retries + 1} attempts: {error}",
+          file=sys.stderr)
+    transfer.failed.append(image)
+    return None
+
+
+def _fetch_raw_image(sftp, remote_path, size=None):
+    """Transfer the raw image file into memory.
+
+    Keyword arguments:
+    sftp = paramiko SFTP connection object.
+    remote_path = remote filepath.
+    size = expected file size in bytes, if known.
+
+    Returns:
+    raw = raw image data.
+
+    :param sftp: paramiko.sftp_client.SFTPClient
+    :param remote_path: str
+    :param size: int
+    :return raw: bytes
+    """
+    buffer = io.BytesIO()
+    if size is None:
+        sftp.getfo(remote_path, buffer)
+    else:
+        _read_raw_image(sftp=sftp, remote_path=remote_path, fp=buffer, size=size)
+    return buffer.getvalue()
+
+
+def _transfer_raw_image(sftp, remote_path, local_path, size=None):
     """Transfer the raw image file.
 
     Keyword arguments:
     sftp = paramiko SFTP connection object.
     remote_path = remote filepath.
     local_path = local filepath.
+    size = expected file size in bytes, if known.
 
     :param sftp: paramiko.sftp_client.SFTPClient
     :param remote_path: str
     :param local_path: str
+    :param size: int
     """
-    try:
+    if size is None:
         sftp.get(remote_path, local_path)
-    except IOError as e:
-        print(f"I/O error({e.errno}): {e.strerror}. Offending file: {remote_path}", file=sys.stderr)
+    else:
+        with open(local_path, "wb") as fp:
+            _read_raw_image(sftp=sftp, remote_path=remote_path, fp=fp, size=size)
+
+
+def _read_raw_image(sftp, remote_path, fp, size):
+    """Copy a remote file of known size, skipping the stat request that SFTPClient.get makes.
+
+    Keyword arguments:
+    sftp = paramiko SFTP connection object.
+    remote_path = remote filepath.
+    fp = local file-like object.
+    size = expected file size in bytes.
+
+    :param sftp: paramiko.sftp_client.SFTPClient
+    :param remote_path: str
+    :param fp: file-like object
+    :param size: int
+    """
+    received = 0
+    with sftp.open(remote_path, "rb") as fr:
+        fr.prefetch(size)
+        while True:
+            data = fr.read(32768)
+            if not data:
+                break
+            fp.write(data)
+            received += len(data)
+    if received != size:
+        raise IOError(errno.EIO, f"size mismatch ({received} != {size} bytes)")
 
 
 def _convert_raw_to_png(raw, filename, height, width, dtype, imgtype, bayertype, precision, flip):
     """Convert the raw image to PNG format.
 
     Keyword arguments:
-    raw = raw image file
+    raw = raw image file path or file-like object
     filename = image filename
     height = height of the image
     width = width of the image
@@ -88,7 +627,7 @@ def _convert_raw_to_png(raw, filename, height, width, dtype, imgtype, bayertype,
     precision = precision (bits) of the raw image values
     flip = flag indicating whether to rotate and flip the image or not
 
-    :param raw: str
+    :param raw: str or io.BytesIO
     :param filename: str
     :param height: int
     :param width: int
@@ -98,6 +637,8 @@ def _convert_raw_to_png(raw, filename, height, width, dtype, imgtype, bayertype,
     :param precision: int
     :param flip: int
     """
+    # Name of the raw image source for warning messages
+    source = raw if isinstance(raw, str) else "in memory"
     # Is the file a zip file?
     if zipfile.is_zipfile(raw):
         # Initialize a ZipFile object
@@ -111,7 +652,7 @@ def _convert_raw_to_png(raw, filename, height, width, dtype, imgtype, bayertype,
                 # Convert the image string into a linear array of the correct data type
                 raw = np.frombuffer(img_str, dtype=dtype, count=height * width)
             except ValueError:
-                print(f"Warning: the raw file {raw} containing image {filename} is corrupted.", file=sys.stderr)
+                print(f"Warning: the raw file {source} containing image {filename} is corrupted.", file=sys.stderr)
                 return False
             # Reshape the linear array into a 2-d array
             img = raw.reshape((height, width))
@@ -127,7 +668,7 @@ def _convert_raw_to_png(raw, filename, height, width, dtype, imgtype, bayertype,
                 # Rotate and flip the image if needed
                 img = _rotate_image(img)
             return img
-    print(f"Warning: the raw file {raw} containing image {filename} is corrupted.", file=sys.stderr)
+    print(f"Warning: the raw file {source} containing image {filename} is corrupted.", file=sys.stderr)
     return False
 
 
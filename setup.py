@@ -87,9 +87,13 @@ setuptools.setup(
     # extras_require={
     #     'test': ['pytest-runner', 'pytest'],
     # },
+    extras_require={
+        'parquet': ['pyarrow'],
+    },
     setup_requires=["pytest-runner"],
     tests_require=['pytest'],
-    scripts=["hyperbot-data-manager.py", "lemnatec-dataset-downloader", "dataset-stats", "dataset-qc"],
+    scripts=["hyperbot-data-manager.py", "lemnatec-dataset-downloader", "dataset-stats", "dataset-qc",
+             "dataset-export"],
     cmdclass=versioneer.get_cmdclass()
 
     # If there are data files included in your packages that need to be
@@ -3,9 +3,22 @@
 import os
 import shutil
 import json
+import io
+import re
+import time
+import errno
+import zipfile
+import tracemalloc
 from copy import deepcopy
+from dataclasses import replace
+from datetime import datetime
+from zoneinfo import ZoneInfo
+import numpy as np
+import paramiko
 import pytest
 import dsf
+from dsf.data import lemnatec
+from dsf.data.lemnatec.config import Config
 
 TEST_TMPDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".cache")
 TEST_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
@@ -56,6 +69,232 @@ TASKS = [{
     "sensor": "vnir"
 }]
 
+LEMNATEC_CONFIG = Config(username="user", password="password", hostname="hostname",
+                         dataformat={"0": {"datatype": "uint8", "imgtype": "gray", "bit-precision": 8},
+                                     "1": {"datatype": "uint8", "imgtype": "color", "bit-precision": 8}},
+                         metadata={"imgtype": "^(VIS|NIR)", "camera": "(SV|TV)", "angle": "(\\d+)$"},
+                         timezone="America/Chicago", database="lemnatec", experiment="experiment")
+
+
+class FakeSFTPFile(io.FileIO):
+    """Local file with the paramiko SFTPFile prefetch method."""
+    def prefetch(self, file_size=None):
+        pass
+
+
+class FakeSFTP:
+    """Serve raw image blobs from a local directory in place of the database server.
+
+    The connection drops after the number of requests in drop_after, and blobs or directories listed in errors raise
+    I/O errors the given number of times.
+    """
+    def __init__(self, root, drop_after=None, errors=None):
+        self.root = root
+        self.transfers = []
+        self.drop_after = drop_after
+        self.errors = errors or {}
+        self.closed = False
+
+    def _path(self, remote_path):
+        return os.path.join(self.root, os.path.relpath(remote_path, "/"))
+
+    def _request(self, remote_path):
+        if self.closed or self.drop_after == 0:
+            self.closed = True
+            raise paramiko.SSHException("Server connection dropped")
+        if self.drop_after is not None:
+            self.drop_after -= 1
+        blob = os.path.basename(remote_path)
+        if self.errors.get(blob):
+            self.errors[blob] -= 1
+            raise OSError(errno.EIO, "I/O error")
+        self.transfers.append(remote_path)
+
+    def get(self, remotepath, localpath):
+        self._request(remotepath)
+        shutil.copyfile(self._path(remotepath), localpath)
+
+    def getfo(self, remotepath, fl):
+        self._request(remotepath)
+        with open(self._path(remotepath), "rb") as fp:
+            fl.write(fp.read())
+
+    def open(self, filename, mode="r"):
+        self._request(filename)
+        return FakeSFTPFile(self._path(filename), mode)
+
+    def listdir_attr(self, path="."):
+        directory = os.path.basename(path)
+        if self.errors.get(directory):
+            self.errors[directory] -= 1
+            raise OSError(errno.EIO, "I/O error")
+        path = self._path(path)
+        return [paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(path, f)), f) for f in os.listdir(path)]
+
+    def get_channel(self):
+        return self
+
+    def get_transport(self):
+        return self
+
+    def is_active(self):
+        return not self.closed
+
+    def close(self):
+        self.closed = True
+
+
+class FakeColumn:
+    """Cursor result column description."""
+    def __init__(self, name, type_code):
+        self.name = name
+        self.type_code = type_code
+
+
+class FakeCopy:
+    """COPY TO STDOUT operation returning fixed rows."""
+    def __init__(self, rows):
+        self.rows_ = rows
+        self.types = None
+
+    def set_types(self, types):
+        self.types = types
+
+    def rows(self):
+        for row in self.rows_:
+            yield tuple(row.values())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class FakeCursor:
+    """Database cursor that answers snapshot and image queries from fixed rows."""
+    def __init__(self, snapshots, tiles):
+        self.snapshots = snapshots
+        self.tiles = tiles
+        self.queries = []
+        self.rows = []
+        self.name = None
+        self.itersize = None
+        self.cursors = []
+        self.connection = self
+
+    def execute(self, query, params=None):
+        query = query.as_string()
+        self.queries.append(query)
+        self.description = None
+        if "DISTINCT measurement_label" in query:
+            self.rows = [{"measurement_label": "experiment"}]
+        elif "LEFT JOIN" in query:
+            # Snapshots without images have empty tile columns
+            imaged = {row["id"] for row in self.tiles}
+            empty = {"camera_label": None, "tiled_image_id": None, "frame": None, "raw_image_oid": None,
+                     "rotate_flip_type": None, "dataformat": None, "width": None, "height": None}
+            self.rows = sorted(self.tiles + [dict(row, **empty) for row in self.snapshots if row["id"] not in imaged],
+                               key=lambda row: row["id"])
+        else:
+            self.rows = self.tiles if "tile" in query else self.snapshots
+        if params is not None and len(params) > 2:
+            # Snapshot ID watermark and incomplete snapshots
+            self.rows = [row for row in self.rows if row["id"] > params[1] or row["id"] in params[2]]
+        elif params is not None and len(params) > 1:
+            # Snapshot ID watermark
+            self.rows = [row for row in self.rows if row["id"] > params[1]]
+        if query.endswith("LIMIT 0"):
+            self.description = [FakeColumn(name=name, type_code=0) for name in self.rows[0]]
+            self.rows = []
+
+    def copy(self, statement, params=None):
+        self.execute(statement, params)
+        return FakeCopy(rows=self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def cursor(self, name=None, row_factory=None):
+        cursor = FakeCursor(snapshots=self.snapshots, tiles=self.tiles)
+        cursor.name = name
+        self.cursors.append(cursor)
+        return cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+def _lemnatec_rows(n_snapshots, n_tiles):
+    """Build snapshot and joined snapshot/tiled_image/tile database rows."""
+    snapshots = []
+    tiles = []
+    for snapshot_id in range(1, n_snapshots + 1):
+        snapshot = {
+            "id": snapshot_id,
+            "id_tag": f"plant{snapshot_id}",
+            "car_tag": f"car{snapshot_id}",
+            "time_stamp": datetime(2019, 8, 8, 16, 38, 21, 380000, tzinfo=ZoneInfo("America/Chicago")),
+            "weight_before": 100.0,
+            "weight_after": 120.0,
+            "water_amount": 20,
+            "completed": True,
+            "measurement_label": "experiment"
+        }
+        snapshots.append(snapshot)
+        for tile in range(n_tiles):
+            camera_label = ["VIS SV 0", "NIR TV 90"][tile % 2]
+            tiles.append(dict(snapshot, snapshot_id=snapshot_id, camera_label=camera_label,
+                              tiled_image_id=snapshot_id * 100 + tile, frame=1, raw_image_oid=snapshot_id * 1000 + tile,
+                              rotate_flip_type=0, dataformat=0, width=6, height=4))
+    return snapshots, tiles
+
+
+def _lemnatec_image(oid, camera_label="NIR-SV-0", snapshot=1, dataformat="0", height=4, width=6):
+    """Build an image metadata record and its relative image path."""
+    image = os.path.join("plant1", "2019-08-08", f"snapshot{snapshot}", f"{camera_label}_{oid}_1.png")
+    record = {
+        "snapshot": f"snapshot{snapshot}",
+        "barcode": "plant1",
+        "cartag": "car1",
+        "timestamp": "2019-08-08T21:38:21.380000Z",
+        "local_time": "2019-08-08T16:38:21.380000-0500",
+        "camera_label": camera_label,
+        "tiled_image_id": oid,
+        "frame": 1,
+        "raw_image_oid": oid,
+        "rotate_flip_type": 0,
+        "dataformat": dataformat,
+        "width": width,
+        "height": height
+    }
+    return image, record
+
+
+def _lemnatec_blob(root, oid, height=4, width=6, data=None):
+    """Write a zipped raw image blob to the fake database server directory."""
+    blob_dir = os.path.join(root, "data", "pgftp", "lemnatec", "2019-08-08")
+    os.makedirs(blob_dir, exist_ok=True)
+    if data is None:
+        data = np.arange(height * width, dtype=np.uint8).tobytes()
+    with zipfile.ZipFile(os.path.join(blob_dir, f"blob{oid}"), "w") as zf:
+        zf.writestr("data", data)
+
+
+def _lemnatec_dataset(n_images):
+    """Build dataset metadata and blobs for n images."""
+    root = os.path.join(TEST_TMPDIR, "server")
+    metadata = {"dataset": {}, "environment": {}, "images": {}}
+    for oid in range(n_images):
+        image, record = _lemnatec_image(oid=oid)
+        metadata["images"][image] = record
+        _lemnatec_blob(root=root, oid=oid)
+    return metadata, root
+
+
 def setup_function():
     """Test setup function."""
     if not os.path.exists(TEST_TMPDIR):
@@ -149,6 +388,749 @@ def test_data_hyperbot_delete_source_scan_files():
                                            "2019-08-08__16-38-21-380"))
 
 
+def test_data_lemnatec_transfer_images():
+    metadata, root = _lemnatec_dataset(n_images=3)
+    dataset_dir = os.path.join(TEST_TMPDIR, "dataset")
+    lemnatec.transfer_images(metadata=metadata, sftp=FakeSFTP(root=root), dataset_dir=dataset_dir,
+                             config=LEMNATEC_CONFIG)
+    for image in metadata["images"]:
+        assert os.path.exists(os.path.join(dataset_dir, image))
+    assert not os.path.exists(os.path.join(dataset_dir, "plant1", "2019-08-08", "snapshot1", "blob0"))
+
+
+def test_data_lemnatec_transfer_images_workers(monkeypatch):
+    metadata, root = _lemnatec_dataset(n_images=10)
+    dataset_dir = os.path.join(TEST_TMPDIR, "dataset")
+    connections = []
+
+    def open_fake_sftp(config):
+        connections.append(FakeSFTP(root=root))
+        return connections[-1]
+    monkeypatch.setattr(lemnatec.transfers, "open_sftp_connection", open_fake_sftp)
+    monkeypatch.setattr(lemnatec.transfers, "close_sftp_connection", lambda sftp: sftp.close())
+    lemnatec.transfer_images(metadata=metadata, sftp=None, dataset_dir=dataset_dir, config=LEMNATEC_CONFIG,
+                             workers=3)
+    assert len(connections) == 3
+    assert sum(len(sftp.transfers) for sftp in connections) == 10
+    for image in metadata["images"]:
+        assert os.path.exists(os.path.join(dataset_dir, image))
+
+
+@pytest.mark.parametrize("index_remote", [False, True])
+def test_data_lemnatec_transfer_images_pool(monkeypatch, index_remote):
+    connections = []
+
+    def open_fake_sftp(config):
+        connections.append(FakeSFTP(root=root))
+        return connections[-1]
+    monkeypatch.setattr(lemnatec.connections, "open_sftp_connection", open_fake_sftp)
+    monkeypatch.setattr(lemnatec.connections, "close_sftp_connection", lambda sftp: sftp.close())
+    pool = lemnatec.ConnectionPool(config=LEMNATEC_CONFIG, size=2)
+    # Two experiments downloaded one after the other reuse the pooled connections
+    for experiment in ["exp1", "exp2"]:
+        metadata, root = _lemnatec_dataset(n_images=4)
+        dataset_dir = os.path.join(TEST_TMPDIR, experiment)
+        # Only the workers have connections, the remote listing leases one from the pool
+        lemnatec.transfer_images(metadata=metadata, sftp=None, dataset_dir=dataset_dir, config=LEMNATEC_CONFIG,
+                                 workers=2, pool=pool, index_remote=index_remote)
+        for image in metadata["images"]:
+            assert os.path.exists(os.path.join(dataset_dir, image))
+    assert len(connections) <= 2
+    pool.close()
+    assert all(sftp.closed for sftp in connections)
+
+
+def test_data_lemnatec_list_experiments():
+    db = FakeCursor(snapshots=[], tiles=[])
+    assert lemnatec.list_experiments(db=db, pattern="exp%") == ["experiment"]
+    assert "LIKE" in db.queries[0]
+
+
+def test_data_lemnatec_transfer_images_processes():
+    metadata, root = _lemnatec_dataset(n_images=6)
+    dataset_dir = os.path.join(TEST_TMPDIR, "dataset")
+    lemnatec.transfer_images(metadata=metadata, sftp=FakeSFTP(root=root), dataset_dir=dataset_dir,
+                             config=LEMNATEC_CONFIG, processes=2, queue_size=2)
+    for image in metadata["images"]:
+        assert os.path.exists(os.path.join(dataset_dir, image))
+
+
+def test_data_lemnatec_transfer_images_in_memory():
+    metadata, root = _lemnatec_dataset(n_images=2)
+    # Replace the second blob with a truncated raw image
+    _lemnatec_blob(root=root, oid=1, data=b"0")
+    dataset_dir = os.path.join(TEST_TMPDIR, "dataset")
+    lemnatec.transfer_images(metadata=metadata, sftp=FakeSFTP(root=root), dataset_dir=dataset_dir,
+                             config=LEMNATEC_CONFIG, in_memory=True)
+    snapshot_dir = os.path.join(dataset_dir, "plant1", "2019-08-08", "snapshot1")
+    assert sorted(os.listdir(snapshot_dir)) == ["NIR-SV-0_0_1.png", "blob1"]
+
+
+@pytest.mark.parametrize("in_memory", [False, True])
+def test_data_lemnatec_transfer_images_index_remote(in_memory):
+    metadata, root = _lemnatec_dataset(n_images=3)
+    os.remove(os.path.join(root, "data", "pgftp", "lemnatec", "2019-08-08", "blob2"))
+    dataset_dir = os.path.join(TEST_TMPDIR, "dataset")
+    sftp = FakeSFTP(root=root)
+    lemnatec.transfer_images(metadata=metadata, sftp=sftp, dataset_dir=dataset_dir, config=LEMNATEC_CONFIG,
+                             in_memory=in_memory, index_remote=True)
+    # The missing blob is never requested
+    assert sorted(sftp.transfers) == ["/data/pgftp/lemnatec/2019-08-08/blob0", "/data/pgftp/lemnatec/2019-08-08/blob1"]
+    snapshot_dir = os.path.join(dataset_dir, "plant1", "2019-08-08", "snapshot1")
+    assert sorted(os.listdir(snapshot_dir)) == ["NIR-SV-0_0_1.png", "NIR-SV-0_1_1.png"]
+
+
+@pytest.mark.parametrize("listing_errors", [1, 10])
+def test_data_lemnatec_transfer_images_index_remote_errors(listing_errors):
+    metadata, root = _lemnatec_dataset(n_images=3)
+    os.remove(os.path.join(root, "data", "pgftp", "lemnatec", "2019-08-08", "blob2"))
+    dataset_dir = os.path.join(TEST_TMPDIR, "dataset")
+    sftp = FakeSFTP(root=root, errors={"2019-08-08": listing_errors})
+    lemnatec.transfer_images(metadata=metadata, sftp=sftp, dataset_dir=dataset_dir, config=LEMNATEC_CONFIG,
+                             index_remote=True, retries=2, backoff=0)
+    snapshot_dir = os.path.join(dataset_dir, "plant1", "2019-08-08", "snapshot1")
+    # Images are downloaded whether the listing succeeds on retry or falls back to unindexed transfers
+    assert sorted(os.listdir(snapshot_dir)) == ["NIR-SV-0_0_1.png", "NIR-SV-0_1_1.png"]
+
+
+def test_data_lemnatec_scan_dataset():
+    dataset_dir = os.path.join(TEST_TMPDIR, "dataset")
+    os.makedirs(os.path.join(dataset_dir, "plant1", "2019-08-08", "snapshot1"))
+    with open(os.path.join(dataset_dir, "plant1", "2019-08-08", "snapshot1", "NIR-SV-0_0_1.png"), "w") as fp:
+        fp.write("")
+    inventory = lemnatec.scan_dataset(dataset_dir=dataset_dir)
+    assert inventory.exists(os.path.join("plant1", "2019-08-08", "snapshot1", "NIR-SV-0_0_1.png"))
+    assert inventory.dirs == {"plant1", os.path.join("plant1", "2019-08-08"),
+                              os.path.join("plant1", "2019-08-08", "snapshot1")}
+
+
+def test_data_lemnatec_transfer_images_resume():
+    metadata, root = _lemnatec_dataset(n_images=3)
+    dataset_dir = os.path.join(TEST_TMPDIR, "dataset")
+    lemnatec.transfer_images(metadata=metadata, sftp=FakeSFTP(root=root), dataset_dir=dataset_dir,
+                             config=LEMNATEC_CONFIG, journal=False)
+    os.remove(os.path.join(dataset_dir, "plant1", "2019-08-08", "snapshot1", "NIR-SV-0_1_1.png"))
+    sftp = FakeSFTP(root=root)
+    inventory = lemnatec.scan_dataset(dataset_dir=dataset_dir)
+    lemnatec.transfer_images(metadata=metadata, sftp=sftp, dataset_dir=dataset_dir, config=LEMNATEC_CONFIG,
+                             inventory=inventory, journal=False)
+    assert sftp.transfers == ["/data/pgftp/lemnatec/2019-08-08/blob1"]
+    assert inventory.exists(os.path.join("plant1", "2019-08-08", "snapshot1", "NIR-SV-0_1_1.png"))
+
+
+def test_data_lemnatec_transfer_images_journal():
+    metadata, root = _lemnatec_dataset(n_images=3)
+    blob = os.path.join(root, "data", "pgftp", "lemnatec", "2019-08-08", "blob2")
+    os.rename(blob, f"{blob}.bak")
+    dataset_dir = os.path.join(TEST_TMPDIR, "dataset")
+    lemnatec.transfer_images(metadata=metadata, sftp=FakeSFTP(root=root), dataset_dir=dataset_dir,
+                             config=LEMNATEC_CONFIG, in_memory=True)
+    states = lemnatec.dataset.load_journal(dataset_dir=dataset_dir)
+    assert [states[image] for image in metadata["images"]] == ["written", "written", "failed"]
+    # Resuming only transfers the failed image, without scanning the dataset
+    os.rename(f"{blob}.bak", blob)
+    sftp = FakeSFTP(root=root)
+    lemnatec.transfer_images(metadata=metadata, sftp=sftp, dataset_dir=dataset_dir, config=LEMNATEC_CONFIG)
+    assert sftp.transfers == ["/data/pgftp/lemnatec/2019-08-08/blob2"]
+    states = lemnatec.dataset.load_journal(dataset_dir=dataset_dir)
+    assert [states[image] for image in metadata["images"]] == ["written", "written", "written"]
+
+
+def test_data_lemnatec_transfer_images_rescan():
+    metadata, root = _lemnatec_dataset(n_images=3)
+    dataset_dir = os.path.join(TEST_TMPDIR, "dataset")
+    lemnatec.transfer_images(metadata=metadata, sftp=FakeSFTP(root=root), dataset_dir=dataset_dir,
+                             config=LEMNATEC_CONFIG)
+    image = list(metadata["images"])[1]
+    os.remove(os.path.join(dataset_dir, image))
+    # The journal still records the deleted image as written
+    sftp = FakeSFTP(root=root)
+    lemnatec.transfer_images(metadata=metadata, sftp=sftp, dataset_dir=dataset_dir, config=LEMNATEC_CONFIG)
+    assert sftp.transfers == []
+    # Rescanning the dataset directory restarts the journal and transfers the deleted image again
+    sftp = FakeSFTP(root=root)
+    lemnatec.transfer_images(metadata=metadata, sftp=sftp, dataset_dir=dataset_dir, config=LEMNATEC_CONFIG,
+                             rescan=True)
+    assert sftp.transfers == ["/data/pgftp/lemnatec/2019-08-08/blob1"]
+    assert os.path.exists(os.path.join(dataset_dir, image))
+    with open(os.path.join(dataset_dir, lemnatec.dataset.JOURNAL_FILE), "r") as fp:
+        assert len(fp.readlines()) == 4
+
+
+def test_data_lemnatec_journal_partial_record():
+    dataset_dir = os.path.join(TEST_TMPDIR, "dataset")
+    os.makedirs(dataset_dir)
+    # A record that was partially written before a crash
+    with open(os.path.join(dataset_dir, lemnatec.dataset.JOURNAL_FILE), "w") as fp:
+        fp.write("written\tplant1/image0.png\nwrit")
+    journal = lemnatec.dataset.Journal(dataset_dir=dataset_dir)
+    journal.record(image="plant1/image1.png", state="written")
+    journal.close()
+    states = lemnatec.dataset.load_journal(dataset_dir=dataset_dir)
+    assert states == {"plant1/image0.png": "written", "plant1/image1.png": "written"}
+
+
+def test_data_lemnatec_transfer_images_checkpoints(monkeypatch):
+    metadata, root = _lemnatec_dataset(n_images=3)
+    dataset_dir = os.path.join(TEST_TMPDIR, "dataset")
+    synced = []
+    monkeypatch.setattr(lemnatec.dataset.os, "fsync", lambda fd: synced.append(fd))
+    lemnatec.transfer_images(metadata=metadata, sftp=FakeSFTP(root=root), dataset_dir=dataset_dir,
+                             config=LEMNATEC_CONFIG, checkpoint_interval=0)
+    # One checkpoint per fetched and written image state, and one when the journal is closed
+    assert len(synced) == 7
+    states = lemnatec.dataset.load_journal(dataset_dir=dataset_dir)
+    assert [states[image] for image in metadata["images"]] == ["written", "written", "written"]
+
+
+def test_data_lemnatec_save_dataset_atomic():
+    dataset_dir, meta = _lemnatec_synced_dataset(layout="json")
+    metadata_file = os.path.join(dataset_dir, "metadata.json")
+    with open(metadata_file, "rb") as fp:
+        saved = fp.read()
+    # A failed save leaves the previous metadata in place
+    meta["dataset"]["unserializable"] = object()
+    with pytest.raises(TypeError):
+        lemnatec.save_dataset(dataset_dir=dataset_dir, metadata=meta, serializer="json")
+    with open(metadata_file, "rb") as fp:
+        assert fp.read() == saved
+
+
+def test_data_lemnatec_transfer_images_reconnect(monkeypatch):
+    metadata, root = _lemnatec_dataset(n_images=4)
+    dataset_dir = os.path.join(TEST_TMPDIR, "dataset")
+    connections = []
+
+    def open_fake_sftp(config):
+        connections.append(FakeSFTP(root=root))
+        return connections[-1]
+    monkeypatch.setattr(lemnatec.transfers, "open_sftp_connection", open_fake_sftp)
+    monkeypatch.setattr(lemnatec.transfers, "close_sftp_connection", lambda sftp: sftp.close())
+    sftp = FakeSFTP(root=root, drop_after=2)
+    lemnatec.transfer_images(metadata=metadata, sftp=sftp, dataset_dir=dataset_dir, config=LEMNATEC_CONFIG,
+                             backoff=0)
+    assert len(connections) == 1
+    assert len(sftp.transfers) + len(connections[0].transfers) == 4
+    for image in metadata["images"]:
+        assert os.path.exists(os.path.join(dataset_dir, image))
+
+
+def test_data_lemnatec_transfer_images_failure_queue():
+    metadata, root = _lemnatec_dataset(n_images=3)
+    dataset_dir = os.path.join(TEST_TMPDIR, "dataset")
+    # blob1 fails on both attempts of the first pass and succeeds on the end of run retry
+    sftp = FakeSFTP(root=root, errors={"blob1": 2})
+    lemnatec.transfer_images(metadata=metadata, sftp=sftp, dataset_dir=dataset_dir, config=LEMNATEC_CONFIG,
+                             retries=1, backoff=0)
+    assert sftp.transfers[-1] == "/data/pgftp/lemnatec/2019-08-08/blob1"
+    states = lemnatec.dataset.load_journal(dataset_dir=dataset_dir)
+    assert [states[image] for image in metadata["images"]] == ["written", "written", "written"]
+
+
+def test_data_lemnatec_query_snapshots():
+    snapshots, tiles = _lemnatec_rows(n_snapshots=2, n_tiles=2)
+    metadata = {"dataset": {}, "environment": {}, "images": {}}
+    meta = lemnatec.query_snapshots(db=FakeCursor(snapshots=snapshots, tiles=tiles), metadata=metadata,
+                                    experiment="experiment", config=LEMNATEC_CONFIG)
+    assert metadata["environment"] == {}
+    assert meta["environment"]["snapshot1"]["timestamp"] == "2019-08-08T21:38:21.380000Z"
+    assert meta["environment"]["snapshot1"]["local_time"] == "2019-08-08T16:38:21.380000-0500"
+
+
+def test_data_lemnatec_query_images_fetch_size():
+    snapshots, tiles = _lemnatec_rows(n_snapshots=2, n_tiles=2)
+    db = FakeCursor(snapshots=snapshots, tiles=tiles)
+    meta = lemnatec.query_images(db=db, metadata={"dataset": {}, "environment": {}, "images": {}},
+                                 experiment="experiment", config=LEMNATEC_CONFIG, fetch_size=1000)
+    # Rows are streamed from a named server-side cursor
+    assert db.queries == []
+    assert db.cursors[0].name is not None and db.cursors[0].itersize == 1000
+    image = meta["images"][os.path.join("plant1", "2019-08-08", "snapshot1", "NIR TV 90_101_1.png")]
+    assert image["imgtype"] == "NIR" and image["camera"] == "TV"
+
+
+def test_data_lemnatec_watermark():
+    snapshots, tiles = _lemnatec_rows(n_snapshots=3, n_tiles=2)
+    snapshots[2]["completed"] = False
+    metadata = {"dataset": {}, "environment": {}, "images": {}}
+    assert lemnatec.get_watermark(metadata=metadata) is None
+    meta = lemnatec.query_snapshots(db=FakeCursor(snapshots=snapshots, tiles=tiles), metadata=metadata,
+                                    experiment="experiment", config=LEMNATEC_CONFIG)
+    lemnatec.update_watermark(metadata=meta)
+    # The incomplete snapshot is not covered by the watermark
+    assert lemnatec.get_watermark(metadata=meta) == 2
+    db = FakeCursor(snapshots=snapshots, tiles=tiles)
+    meta = lemnatec.query_images(db=db, metadata=meta, experiment="experiment", config=LEMNATEC_CONFIG,
+                                 since=lemnatec.get_watermark(metadata=meta))
+    # The incomplete snapshot is retrieved again
+    assert "AND (snapshot.id > %s OR snapshot.id = ANY(%s))" in db.queries[0]
+    assert db.queries[0].startswith('SELECT "snapshot_id", "id_tag", "car_tag", "time_stamp", "camera_label"')
+    assert {image["snapshot"] for image in meta["images"].values()} == {"snapshot3"}
+
+
+def test_data_lemnatec_watermark_incomplete_snapshot():
+    snapshots, tiles = _lemnatec_rows(n_snapshots=4, n_tiles=2)
+    # An older snapshot is still incomplete when newer snapshots are completed
+    snapshots[1]["completed"] = False
+    metadata = {"dataset": {"watermark": {"snapshot_id": 3, "timestamp": None}}, "environment": {}, "images": {}}
+    meta = lemnatec.query_snapshots(db=FakeCursor(snapshots=snapshots, tiles=tiles), metadata=metadata,
+                                    experiment="experiment", config=LEMNATEC_CONFIG)
+    lemnatec.update_watermark(metadata=meta)
+    assert lemnatec.get_watermark(metadata=meta) == 1
+    # Without a completed snapshot below the incomplete one there is no watermark
+    snapshots[0]["completed"] = False
+    metadata = {"dataset": {}, "environment": {}, "images": {}}
+    meta = lemnatec.query_snapshots(db=FakeCursor(snapshots=snapshots, tiles=tiles), metadata=metadata,
+                                    experiment="experiment", config=LEMNATEC_CONFIG)
+    lemnatec.update_watermark(metadata=meta)
+    assert lemnatec.get_watermark(metadata=meta) is None
+
+
+@pytest.mark.parametrize("layout", ["json", "sharded", "sqlite"])
+@pytest.mark.parametrize("single_pass", [False, True])
+def test_data_lemnatec_watermark_completed_later(layout, single_pass):
+    snapshots, tiles = _lemnatec_rows(n_snapshots=3, n_tiles=2)
+    dataset_dir = os.path.join(TEST_TMPDIR, "dataset")
+    lemnatec.init_dataset(dataset_dir=dataset_dir, config=LEMNATEC_CONFIG, layout=layout)
+
+    def sync(snapshots, tiles):
+        meta = lemnatec.load_dataset(dataset_dir=dataset_dir)
+        db = FakeCursor(snapshots=snapshots, tiles=tiles)
+        since = lemnatec.get_watermark(metadata=meta)
+        if single_pass:
+            environment, images = lemnatec.fetch_experiment(db=db, metadata=meta, experiment="experiment",
+                                                            config=LEMNATEC_CONFIG, since=since)
+        else:
+            environment = lemnatec.fetch_snapshots(db=db, metadata=meta, experiment="experiment",
+                                                   config=LEMNATEC_CONFIG, since=since)
+            images = lemnatec.fetch_images(db=db, metadata=meta, experiment="experiment", config=LEMNATEC_CONFIG,
+                                           since=since)
+        lemnatec.merge_records(metadata=meta, environment=environment, images=images)
+        lemnatec.update_watermark(metadata=meta)
+        lemnatec.save_dataset(dataset_dir=dataset_dir, metadata=meta)
+        return lemnatec.load_dataset(dataset_dir=dataset_dir)
+
+    # Snapshot 2 is still being imaged during the first sync
+    for row in [snapshots[1]] + tiles[2:4]:
+        row["completed"] = False
+    meta = sync(snapshots=snapshots, tiles=tiles[:3] + tiles[4:])
+    assert lemnatec.get_watermark(metadata=meta) == 1
+    # Snapshot 2 is completed and has its last image by the next sync
+    for row in [snapshots[1]] + tiles[2:4]:
+        row["completed"] = True
+    meta = sync(snapshots=snapshots, tiles=tiles)
+    assert meta["environment"]["snapshot2"]["completed"]
+    assert len(meta["images"]) == 6
+    assert lemnatec.get_watermark(metadata=meta) == 3
+    assert len(meta["environment"]) == 3
+    # The replaced snapshot record is only streamed once
+    assert len(list(lemnatec.iter_records(dataset_dir=dataset_dir, section="environment"))) == 3
+    meta = sync(snapshots=snapshots, tiles=tiles)
+    assert lemnatec.get_watermark(metadata=meta) == 3
+
+
+def test_data_lemnatec_sharded_dataset():
+    snapshots, tiles = _lemnatec_rows(n_snapshots=3, n_tiles=2)
+    # Snapshot 3 was taken the next day
+    for row in [snapshots[2]] + tiles[4:]:
+        row["time_stamp"] = datetime(2019, 8, 9, 12, 0, 0, 0, tzinfo=ZoneInfo("America/Chicago"))
+    dataset_dir = os.path.join(TEST_TMPDIR, "dataset")
+    lemnatec.init_dataset(dataset_dir=dataset_dir, config=LEMNATEC_CONFIG, layout="sharded")
+    assert lemnatec.is_sharded(dataset_dir=dataset_dir)
+    assert not os.path.exists(os.path.join(dataset_dir, "metadata.json"))
+    meta = lemnatec.load_dataset(dataset_dir=dataset_dir)
+    db = FakeCursor(snapshots=snapshots[:2], tiles=tiles[:4])
+    environment, images = lemnatec.fetch_experiment(db=db, metadata=meta, experiment="experiment",
+                                                    config=LEMNATEC_CONFIG)
+    lemnatec.merge_records(metadata=meta, environment=environment, images=images)
+    lemnatec.save_dataset(dataset_dir=dataset_dir, metadata=meta)
+    shard = os.path.join(dataset_dir, "metadata", "images", "2019-08-08.jsonl")
+    with open(shard, "r") as fp:
+        assert len(fp.readlines()) == 4
+    # New records are appended to the shard of their day
+    meta = lemnatec.load_dataset(dataset_dir=dataset_dir)
+    environment, images = lemnatec.fetch_experiment(db=FakeCursor(snapshots=snapshots, tiles=tiles), metadata=meta,
+                                                    experiment="experiment", config=LEMNATEC_CONFIG)
+    lemnatec.merge_records(metadata=meta, environment=environment, images=images)
+    lemnatec.save_dataset(dataset_dir=dataset_dir, metadata=meta)
+    with open(shard, "r") as fp:
+        assert len(fp.readlines()) == 4
+    manifest = lemnatec.load_manifest(dataset_dir=dataset_dir)
+    assert manifest["sections"]["images"]["shards"] == {"2019-08-08": 4, "2019-08-09": 2}
+    assert lemnatec.load_dataset(dataset_dir=dataset_dir) == meta
+    # Readers can open only the partitions they need
+    records = dict(lemnatec.read_records(dataset_dir=dataset_dir, section="images", partitions=["2019-08-09"]))
+    assert {image["snapshot"] for image in records.values()} == {"snapshot3"}
+    # Metadata without all the stored records is rewritten
+    del meta["images"][next(iter(meta["images"]))]
+    lemnatec.save_dataset(dataset_dir=dataset_dir, metadata=meta)
+    assert lemnatec.load_dataset(dataset_dir=dataset_dir)["images"] == meta["images"]
+    assert lemnatec.load_manifest(dataset_dir=dataset_dir)["sections"]["images"]["count"] == 5
+
+
+def test_data_lemnatec_sharded_dataset_unordered(monkeypatch):
+    snapshots, tiles = _lemnatec_rows(n_snapshots=3, n_tiles=1)
+    # The snapshots are on different days and the database returns them out of order
+    for day, rows in zip([9, 8, 10], zip(snapshots, tiles)):
+        for row in rows:
+            row["time_stamp"] = datetime(2019, 8, day, 12, 0, 0, 0, tzinfo=ZoneInfo("America/Chicago"))
+    dataset_dir = os.path.join(TEST_TMPDIR, "dataset")
+    lemnatec.init_dataset(dataset_dir=dataset_dir, config=LEMNATEC_CONFIG, layout="sharded")
+    meta = lemnatec.load_dataset(dataset_dir=dataset_dir)
+    environment, images = lemnatec.fetch_experiment(db=FakeCursor(snapshots=snapshots[:2], tiles=tiles[:2]),
+                                                    metadata=meta, experiment="experiment", config=LEMNATEC_CONFIG)
+    lemnatec.merge_records(metadata=meta, environment=environment, images=images)
+    lemnatec.save_dataset(dataset_dir=dataset_dir, metadata=meta)
+    # The reloaded records are in partition order, so the new record is appended after a different last record
+    meta = lemnatec.load_dataset(dataset_dir=dataset_dir)
+    environment, images = lemnatec.fetch_experiment(db=FakeCursor(snapshots=snapshots, tiles=tiles), metadata=meta,
+                                                    experiment="experiment", config=LEMNATEC_CONFIG)
+    lemnatec.merge_records(metadata=meta, environment=environment, images=images)
+    monkeypatch.setattr(lemnatec.store, "_rewrite_section", lambda **kwargs: pytest.fail("section rewritten"))
+    lemnatec.save_dataset(dataset_dir=dataset_dir, metadata=meta)
+    manifest = lemnatec.load_manifest(dataset_dir=dataset_dir)
+    assert manifest["sections"]["images"]["shards"] == {"2019-08-08": 1, "2019-08-09": 1, "2019-08-10": 1}
+    assert lemnatec.load_dataset(dataset_dir=dataset_dir) == meta
+
+
+def test_data_lemnatec_sqlite_dataset():
+    snapshots, tiles = _lemnatec_rows(n_snapshots=3, n_tiles=2)
+    # Snapshot 3 was taken the next day
+    for row in [snapshots[2]] + tiles[4:]:
+        row["time_stamp"] = datetime(2019, 8, 9, 12, 0, 0, 0, tzinfo=ZoneInfo("America/Chicago"))
+    dataset_dir = os.path.join(TEST_TMPDIR, "dataset")
+    lemnatec.init_dataset(dataset_dir=dataset_dir, config=LEMNATEC_CONFIG, layout="sqlite")
+    assert lemnatec.is_sqlite(dataset_dir=dataset_dir)
+    for n_snapshots in [2, 3]:
+        meta = lemnatec.load_dataset(dataset_dir=dataset_dir)
+        db = FakeCursor(snapshots=snapshots[:n_snapshots], tiles=tiles[:2 * n_snapshots])
+        environment, images = lemnatec.fetch_experiment(db=db, metadata=meta, experiment="experiment",
+                                                        config=LEMNATEC_CONFIG)
+        lemnatec.merge_records(metadata=meta, environment=environment, images=images)
+        lemnatec.save_dataset(dataset_dir=dataset_dir, metadata=meta)
+    assert lemnatec.load_dataset(dataset_dir=dataset_dir) == meta
+    # Indexed selections
+    images = lemnatec.select_images(dataset_dir=dataset_dir, barcode="plant1", imgtype="NIR", camera="TV")
+    assert list(images) == [os.path.join("plant1", "2019-08-08", "snapshot1", "NIR TV 90_101_1.png")]
+    images = lemnatec.select_images(dataset_dir=dataset_dir, imgtype="VIS", start="2019-08-09")
+    assert {image["snapshot"] for image in images.values()} == {"snapshot3"}
+    environment = lemnatec.select_snapshots(dataset_dir=dataset_dir, start="2019-08-08", end="2019-08-09")
+    assert list(environment) == ["snapshot1", "snapshot2"]
+    summary = lemnatec.sqlite_summary(dataset_dir=dataset_dir)
+    assert summary["snapshots"] == 3 and summary["images"] == 6 and summary["last_timestamp"].startswith("2019-08-09")
+
+
+def _lemnatec_synced_dataset(layout):
+    """Build a dataset with three snapshots of two images each in the given metadata layout."""
+    snapshots, tiles = _lemnatec_rows(n_snapshots=3, n_tiles=2)
+    dataset_dir = os.path.join(TEST_TMPDIR, "dataset")
+    lemnatec.init_dataset(dataset_dir=dataset_dir, config=LEMNATEC_CONFIG, layout=layout)
+    meta = lemnatec.load_dataset(dataset_dir=dataset_dir)
+    environment, images = lemnatec.fetch_experiment(db=FakeCursor(snapshots=snapshots, tiles=tiles), metadata=meta,
+                                                    experiment="experiment", config=LEMNATEC_CONFIG)
+    lemnatec.merge_records(metadata=meta, environment=environment, images=images)
+    lemnatec.save_dataset(dataset_dir=dataset_dir, metadata=meta)
+    return dataset_dir, meta
+
+
+@pytest.mark.parametrize("layout", ["json", "sharded", "sqlite"])
+def test_data_lemnatec_iter_records(layout):
+    dataset_dir, meta = _lemnatec_synced_dataset(layout=layout)
+    for section in ["environment", "images"]:
+        assert dict(lemnatec.iter_records(dataset_dir=dataset_dir, section=section)) == meta[section]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 1 << 20])
+def test_data_lemnatec_json_stream(chunk_size):
+    doc = {"dataset": {"name": "a\\\"b", "ids": [1, 2.5, -30e-2, None, True]},
+           "environment": {"snapshot1": {"weight": 12345.678, "tags": {}, "nested": [[], {"x": "}"}]}},
+           "images": {}}
+    for indent in [None, 4]:
+        stream = lemnatec.jsonstream.JSONStream(fp=io.StringIO(json.dumps(doc, indent=indent)), chunk_size=chunk_size)
+        assert stream.value() == doc
+        for section in doc:
+            stream = lemnatec.jsonstream.JSONStream(fp=io.StringIO(json.dumps(doc, indent=indent)),
+                                                    chunk_size=chunk_size)
+            assert lemnatec.jsonstream._seek_section(stream=stream, section=section)
+            assert dict(stream.members()) == doc[section]
+
+
+@pytest.mark.parametrize("layout", ["json", "sharded", "sqlite"])
+def test_data_lemnatec_open_dataset(layout):
+    dataset_dir, meta = _lemnatec_synced_dataset(layout=layout)
+    dataset = lemnatec.open_dataset(dataset_dir=dataset_dir)
+    assert dataset.layout == layout
+    assert dataset.dataset() == meta["dataset"]
+    assert dataset.count(section="environment") == len(meta["environment"])
+    assert dataset.count(section="images") == len(meta["images"])
+    timestamps = sorted(record["timestamp"] for record in meta["environment"].values())
+    assert dataset.timestamp_range() == (timestamps[0], timestamps[-1])
+    assert dict(dataset.records(section="images")) == meta["images"]
+
+
+@pytest.mark.parametrize("layout", ["json", "sharded", "sqlite"])
+def test_data_lemnatec_dataset_summary(layout, monkeypatch):
+    dataset_dir, meta = _lemnatec_synced_dataset(layout=layout)
+    summary = lemnatec.dataset_summary(dataset_dir=dataset_dir)
+    assert summary["snapshots"] == 3 and summary["images"] == 6
+    assert summary["cameras"] == {"VIS": {"SV": 3}, "NIR": {"TV": 3}}
+    assert summary["first_timestamp"].startswith("2019-08-08") and summary["bytes"] > 0
+    # The cached summary is used while the metadata is unchanged
+    compute_summary = lemnatec.summary._compute_summary
+    monkeypatch.setattr(lemnatec.summary, "_compute_summary", lambda dataset: pytest.fail("summary recomputed"))
+    assert lemnatec.dataset_summary(dataset_dir=dataset_dir) == summary
+    # Saving the metadata invalidates the cached summary
+    monkeypatch.setattr(lemnatec.summary, "_compute_summary", compute_summary)
+    meta["images"]["extra.png"] = dict(next(iter(meta["images"].values())), imgtype=None, camera=None)
+    lemnatec.save_dataset(dataset_dir=dataset_dir, metadata=meta)
+    summary = lemnatec.dataset_summary(dataset_dir=dataset_dir)
+    assert summary["images"] == 7 and summary["cameras"]["unknown"] == {"unknown": 1}
+
+
+def test_data_lemnatec_dataset_summary_read_only(monkeypatch):
+    dataset_dir, meta = _lemnatec_synced_dataset(layout="json")
+
+    def read_only(filename, data):
+        raise PermissionError(errno.EACCES, "Permission denied", filename)
+    monkeypatch.setattr(lemnatec.summary, "atomic_write", read_only)
+    # The summary is computed without caching it
+    summary = lemnatec.dataset_summary(dataset_dir=dataset_dir)
+    assert summary["snapshots"] == 3 and summary["images"] == 6
+    assert not os.path.exists(os.path.join(dataset_dir, lemnatec.summary.SUMMARY_FILE))
+
+
+@pytest.mark.parametrize("serializer", list(lemnatec.dataset.SERIALIZERS))
+def test_data_lemnatec_save_dataset_compact(serializer):
+    dataset_dir, meta = _lemnatec_synced_dataset(layout="json")
+    metadata_file = os.path.join(dataset_dir, "metadata.json")
+    indented = os.path.getsize(metadata_file)
+    lemnatec.save_dataset(dataset_dir=dataset_dir, metadata=meta, compact=True, serializer=serializer)
+    assert os.path.getsize(metadata_file) < indented
+    assert lemnatec.load_dataset(dataset_dir=dataset_dir, serializer=serializer) == meta
+    # The compact format is kept by later saves
+    lemnatec.save_dataset(dataset_dir=dataset_dir, metadata=meta, serializer=serializer)
+    with open(metadata_file, "r") as fp:
+        assert "\n" not in fp.read()
+    lemnatec.save_dataset(dataset_dir=dataset_dir, metadata=meta, compact=False, serializer=serializer)
+    assert lemnatec.load_dataset(dataset_dir=dataset_dir) == meta
+
+
+def test_data_lemnatec_serializer_benchmark():
+    # Set DSF_BENCHMARK_IMAGES=1000000 for a full size benchmark
+    n_images = int(os.environ.get("DSF_BENCHMARK_IMAGES", 20000))
+    dataset_dir = os.path.join(TEST_TMPDIR, "dataset")
+    os.makedirs(dataset_dir)
+    meta = {"dataset": {}, "environment": {}, "images": {}}
+    for oid in range(n_images):
+        image, record = _lemnatec_image(oid=oid, snapshot=oid // 10)
+        meta["images"][image] = record
+    for serializer in lemnatec.dataset.SERIALIZERS:
+        for compact in [False, True]:
+            start = time.perf_counter()
+            lemnatec.save_dataset(dataset_dir=dataset_dir, metadata=meta, compact=compact, serializer=serializer)
+            saved = time.perf_counter() - start
+            start = time.perf_counter()
+            loaded = lemnatec.load_dataset(dataset_dir=dataset_dir, serializer=serializer)
+            load_time = time.perf_counter() - start
+            size = os.path.getsize(os.path.join(dataset_dir, "metadata.json"))
+            print(f"{serializer} compact={compact}, {n_images} images: save {saved:.3f} s, load {load_time:.3f} s, "
+                  f"{size} bytes")
+            assert len(loaded["images"]) == n_images
+
+
+@pytest.mark.parametrize("layout", ["json", "sharded", "sqlite"])
+def test_data_lemnatec_load_dataset_compact_records(layout):
+    dataset_dir, meta = _lemnatec_synced_dataset(layout=layout)
+    compact = lemnatec.load_dataset(dataset_dir=dataset_dir, compact_records=True)
+    assert all(isinstance(record, lemnatec.ImageRecord) for record in compact["images"].values())
+    # Compact records compare equal to, and convert back to, the dictionary form
+    assert compact == meta
+    image = next(iter(meta["images"]))
+    assert compact["images"][image]["imgtype"] == meta["images"][image]["imgtype"]
+    assert compact["images"][image].get("missing") is None
+    with pytest.raises(AttributeError):
+        compact["images"][image].barcode = "plant2"
+    lemnatec.save_dataset(dataset_dir=dataset_dir, metadata=compact)
+    lemnatec.expand_images(metadata=compact)
+    assert all(type(record) is dict for record in compact["images"].values())
+    assert lemnatec.load_dataset(dataset_dir=dataset_dir) == meta
+
+
+@pytest.mark.parametrize("layout", ["json", "sharded", "sqlite"])
+def test_data_lemnatec_image_record_memory(layout):
+    n_images = 20000
+    dataset_dir = os.path.join(TEST_TMPDIR, "dataset")
+    lemnatec.init_dataset(dataset_dir=dataset_dir, config=LEMNATEC_CONFIG, layout=layout)
+    meta = lemnatec.load_dataset(dataset_dir=dataset_dir)
+    for oid in range(n_images):
+        image, record = _lemnatec_image(oid=oid, snapshot=oid // 10)
+        record.update({"imgtype": "NIR", "camera": "SV", "angle": "0"})
+        meta["images"][image] = record
+    lemnatec.save_dataset(dataset_dir=dataset_dir, metadata=meta)
+    del meta
+    peaks = {}
+    for compact_records in [False, True]:
+        tracemalloc.start()
+        try:
+            meta = lemnatec.load_dataset(dataset_dir=dataset_dir, compact_records=compact_records)
+            peaks[compact_records] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        del meta
+    print(f"{n_images} image records ({layout}): dict peak {peaks[False]} bytes, compact peak {peaks[True]} bytes")
+    # Records are compacted as they are read, so the dictionary form is never all in memory
+    assert peaks[True] < peaks[False] / 2
+
+
+def test_data_lemnatec_export_parquet():
+    pq = pytest.importorskip("pyarrow.parquet")
+    dataset_dir, meta = _lemnatec_synced_dataset(layout="json")
+    meta["environment"]["snapshot1"]["timestamp"] = "2019-08-08T21:38:21.380123Z"
+    lemnatec.save_dataset(dataset_dir=dataset_dir, metadata=meta)
+    outdir = os.path.join(TEST_TMPDIR, "export")
+    counts = lemnatec.export_parquet(dataset_dir=dataset_dir, outdir=outdir, row_group_size=4)
+    assert counts == {"environment": 3, "images": 6}
+    images = pq.ParquetFile(os.path.join(outdir, "images.parquet"))
+    # Records are streamed in row groups
+    assert images.metadata.num_row_groups == 2
+    table = images.read()
+    assert str(table.schema.field("imgtype").type) == "dictionary<values=string, indices=int32, ordered=0>"
+    assert sorted(table.column("name").to_pylist()) == sorted(meta["images"])
+    # Timestamps keep their microseconds
+    environment = pq.read_table(os.path.join(outdir, "environment.parquet")).to_pylist()
+    assert {row["timestamp"].strftime("%Y-%m-%dT%H:%M:%S.%fZ") for row in environment} == \
+        {record["timestamp"] for record in meta["environment"].values()}
+
+
+def test_data_lemnatec_export_parquet_late_fields():
+    pq = pytest.importorskip("pyarrow.parquet")
+    dataset_dir, meta = _lemnatec_synced_dataset(layout="json")
+    # A field that only appears in the last records, with integer and float values
+    names = list(meta["images"])
+    meta["images"][names[4]]["zoom"] = 90
+    meta["images"][names[5]]["zoom"] = 22.5
+    lemnatec.save_dataset(dataset_dir=dataset_dir, metadata=meta)
+    outdir = os.path.join(TEST_TMPDIR, "export")
+    lemnatec.export_parquet(dataset_dir=dataset_dir, outdir=outdir, row_group_size=2)
+    table = pq.read_table(os.path.join(outdir, "images.parquet"))
+    assert str(table.schema.field("zoom").type) == "double"
+    zooms = dict(zip(table.column("name").to_pylist(), table.column("zoom").to_pylist()))
+    assert zooms[names[4]] == 90 and zooms[names[5]] == 22.5 and zooms[names[0]] is None
+
+
+def test_data_lemnatec_fetch_images_merge_records():
+    snapshots, tiles = _lemnatec_rows(n_snapshots=2, n_tiles=2)
+    metadata = lemnatec.query_images(db=FakeCursor(snapshots=snapshots, tiles=tiles[:2]),
+                                     metadata={"dataset": {}, "environment": {}, "images": {}},
+                                     experiment="experiment", config=LEMNATEC_CONFIG)
+    images = lemnatec.fetch_images(db=FakeCursor(snapshots=snapshots, tiles=tiles), metadata=metadata,
+                                   experiment="experiment", config=LEMNATEC_CONFIG)
+    # Only the records that are not in the dataset are returned
+    assert {image["snapshot"] for image in images.values()} == {"snapshot2"}
+    lemnatec.merge_records(metadata=metadata, images=images)
+    assert len(metadata["images"]) == 4
+
+
+def test_data_lemnatec_fetch_snapshots_extra_columns():
+    snapshots, tiles = _lemnatec_rows(n_snapshots=1, n_tiles=1)
+    config = deepcopy(LEMNATEC_CONFIG)
+    config.extra_columns = {"snapshot": ["measurement_label"]}
+    db = FakeCursor(snapshots=snapshots, tiles=tiles)
+    environment = lemnatec.fetch_snapshots(db=db, metadata={"dataset": {}, "environment": {}, "images": {}},
+                                           experiment="experiment", config=config)
+    assert '"completed", "measurement_label" AS "measurement_label" FROM snapshot' in db.queries[0]
+    assert environment["snapshot1"]["measurement_label"] == "experiment"
+
+
+def test_data_lemnatec_fetch_experiment():
+    snapshots, tiles = _lemnatec_rows(n_snapshots=3, n_tiles=2)
+    # Snapshot 2 is a watering job without images
+    tiles = [row for row in tiles if row["id"] != 2]
+    metadata = {"dataset": {}, "environment": {}, "images": {}}
+    environment, images = lemnatec.fetch_experiment(db=FakeCursor(snapshots=snapshots, tiles=tiles),
+                                                    metadata=metadata, experiment="experiment",
+                                                    config=LEMNATEC_CONFIG)
+    expected_environment = lemnatec.fetch_snapshots(db=FakeCursor(snapshots=snapshots, tiles=tiles),
+                                                    metadata=metadata, experiment="experiment",
+                                                    config=LEMNATEC_CONFIG)
+    expected_images = lemnatec.fetch_images(db=FakeCursor(snapshots=snapshots, tiles=tiles), metadata=metadata,
+                                            experiment="experiment", config=LEMNATEC_CONFIG)
+    assert environment == expected_environment and len(environment) == 3
+    assert images == expected_images and len(images) == 4
+
+
+def test_data_lemnatec_parse_camera_label_benchmark():
+    config = replace(LEMNATEC_CONFIG)
+    labels = ["VIS SV 0", "VIS SV 90", "VIS TV 0", "NIR SV 0", "NIR TV 0"] * 4000
+
+    def parse_uncached(camera_label):
+        camera_meta = {}
+        for term in config.metadata:
+            match = re.search(config.metadata[term], camera_label, flags=re.IGNORECASE)
+            if match is not None:
+                camera_meta[term] = match.groups()[0]
+        return camera_meta
+
+    class CountingPattern:
+        """Compiled pattern that counts its searches."""
+        def __init__(self, pattern):
+            self.pattern = re.compile(pattern, flags=re.IGNORECASE)
+            self.searches = 0
+
+        def search(self, string):
+            self.searches += 1
+            return self.pattern.search(string)
+    config.camera_patterns = {term: CountingPattern(pattern) for term, pattern in config.metadata.items()}
+    start = time.perf_counter()
+    expected = [parse_uncached(camera_label=label) for label in labels]
+    uncached = time.perf_counter() - start
+    start = time.perf_counter()
+    parsed = [lemnatec.database._parse_camera_label(config=config, camera_label=label) for label in labels]
+    cached = time.perf_counter() - start
+    print(f"camera label parsing, {len(labels)} rows: uncached {uncached:.4f} s, cached {cached:.4f} s")
+    assert parsed == expected
+    # Each distinct camera label is only parsed once
+    assert len(config.camera_labels) == 5
+    assert all(pattern.searches == 5 for pattern in config.camera_patterns.values())
+
+
+@pytest.mark.parametrize("timestamp", [
+    datetime(2019, 8, 8, 16, 38, 21, 380000, tzinfo=ZoneInfo("America/Chicago")),
+    datetime(2019, 12, 31, 23, 59, 59, tzinfo=ZoneInfo("America/Chicago")),
+    datetime(2020, 3, 8, 1, 0, 0, 5, tzinfo=ZoneInfo("Asia/Kolkata"))
+])
+def test_data_lemnatec_format_timestamps(timestamp):
+    utc = timestamp.astimezone(ZoneInfo("UTC"))
+    times = lemnatec.database._format_timestamps(timestamp=timestamp, utc_tz=ZoneInfo("UTC"))
+    assert times == {"timestamp": utc.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                     "local_time": timestamp.strftime("%Y-%m-%dT%H:%M:%S.%f%z"),
+                     "date": utc.strftime("%Y-%m-%d")}
+
+
+def test_data_lemnatec_iter_experiment():
+    snapshots, tiles = _lemnatec_rows(n_snapshots=3, n_tiles=2)
+    # Snapshot 2 is a watering job without images
+    tiles = [row for row in tiles if row["id"] != 2]
+    db = FakeCursor(snapshots=snapshots, tiles=tiles)
+    grouped = [(snapshot["id"], [tile["tiled_image_id"] for tile in group])
+               for snapshot, group in lemnatec.iter_experiment(db=db, experiment="experiment", fetch_size=2)]
+    assert grouped == [(1, [100, 101]), (2, []), (3, [300, 301])]
+    # The experiment filter is part of the streamed query
+    assert "WHERE measurement_label = %s" in db.cursors[0].queries[0]
+
+
+def test_data_lemnatec_fetch_experiment_bulk():
+    snapshots, tiles = _lemnatec_rows(n_snapshots=2, n_tiles=2)
+    metadata = {"dataset": {}, "environment": {}, "images": {}}
+    db = FakeCursor(snapshots=snapshots, tiles=tiles)
+    environment, images = lemnatec.fetch_experiment(db=db, metadata=metadata, experiment="experiment",
+                                                    config=LEMNATEC_CONFIG, bulk=True)
+    assert db.queries[1].startswith("COPY (SELECT") and db.queries[1].endswith(") TO STDOUT (FORMAT BINARY)")
+    expected = lemnatec.fetch_experiment(db=FakeCursor(snapshots=snapshots, tiles=tiles), metadata=metadata,
+                                         experiment="experiment", config=LEMNATEC_CONFIG)
+    assert (environment, images) == expected
+
+
 def teardown_function():
     """Test teardown function."""
     shutil.rmtree(TEST_TMPDIR)